@@ -0,0 +1,10 @@
+"""
+http benchmarks for the auth endpoints.
+
+    python -m benchmarks run --output bench.json
+    python -m benchmarks compare base.json bench.json --threshold 0.1
+
+`run` boots `main.app` in process against a throwaway postgres and a fake
+SMTP server and drives it through httpx's ASGI transport. `compare` exits
+non-zero when an endpoint regressed past the threshold.
+"""
@@ -0,0 +1,185 @@
+import asyncio
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List
+import httpx
+from benchmarks.report import summarize
+
+PASSWORD = "bench-password-1"
+
+# endpoints in run order, register feeds verify with fresh accounts.
+ENDPOINTS = ("login", "me", "refresh", "register", "verify")
+
+
+async def measure(
+    requests: int,
+    concurrency: int,
+    send: Callable[[int], Awaitable[httpx.Response]],
+    expected: int = 200,
+) -> Dict[str, Any]:
+    """
+    call `send(i)` for i in range(requests) with up to `concurrency` calls
+    in flight, timing each one.
+    """
+    latencies: List[float] = []
+    failures: Counter[str] = Counter()
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await send(i)
+                outcome = str(response.status_code)
+            except httpx.HTTPStatusError as error:
+                outcome = str(error.response.status_code)
+            except httpx.HTTPError as error:
+                outcome = type(error).__name__
+            if outcome == str(expected):
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures[outcome] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, failures, time.perf_counter() - started)
+
+
+class AuthBenchmark:
+    """
+    drives the auth endpoints of an already started app.
+
+    Args:
+        client (httpx.AsyncClient): client bound to the app
+        requests (int): measured requests per endpoint
+        concurrency (int): requests in flight per endpoint
+        users (int): verified accounts shared by login, me and refresh
+        warmup (int): unmeasured requests per endpoint before measuring
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        requests: int,
+        concurrency: int,
+        users: int,
+        warmup: int,
+    ):
+        self.client = client
+        self.requests = requests
+        self.concurrency = concurrency
+        self.users = users
+        self.warmup = warmup
+
+        self.emails: List[str] = []
+        self.tokens: List[Dict[str, str]] = []
+        self.registered: List[str] = []
+        self.verification_tokens: List[str] = []
+
+    def _email(self) -> str:
+        return f"bench-{uuid.uuid4().hex}@example.com"
+
+    def _verification_token(self, email: str) -> str:
+        from routers.auth import auth_handler
+        from models.auth import TokenTypeModel
+
+        return auth_handler.generate_token(
+            TokenTypeModel.EMAIL_VERIFICATION_TOKEN, {"email": email}
+        )
+
+    async def setup(self):
+        async def create(i: int) -> httpx.Response:
+            email = self._email()
+            response = await self.client.post(
+                "/auth/register",
+                json={"name": "bench", "email": email, "password": PASSWORD},
+            )
+            response.raise_for_status()
+            response = await self.client.get(
+                f"/auth/verify/{self._verification_token(email)}"
+            )
+            response.raise_for_status()
+            response = await self.client.post(
+                "/auth/login", json={"email": email, "password": PASSWORD}
+            )
+            response.raise_for_status()
+            self.emails.append(email)
+            self.tokens.append(response.json())
+            return response
+
+        result = await measure(self.users, self.concurrency, create)
+        if result["errors"]:
+            raise RuntimeError(
+                f"{result['errors']} benchmark accounts failed setup: "
+                f"{result['failures']}"
+            )
+
+    def _user(self, i: int) -> int:
+        return i % len(self.emails)
+
+    async def login(self, i: int) -> httpx.Response:
+        return await self.client.post(
+            "/auth/login",
+            json={"email": self.emails[self._user(i)], "password": PASSWORD},
+        )
+
+    async def me(self, i: int) -> httpx.Response:
+        token = self.tokens[self._user(i)]["access_token"]
+        return await self.client.get(
+            "/auth/me", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    async def refresh(self, i: int) -> httpx.Response:
+        token = self.tokens[self._user(i)]["refresh_token"]
+        return await self.client.get(f"/auth/refresh/{token}")
+
+    async def register(self, i: int) -> httpx.Response:
+        email = self._email()
+        self.registered.append(email)
+        return await self.client.post(
+            "/auth/register",
+            json={"name": "bench", "email": email, "password": PASSWORD},
+        )
+
+    async def verify(self, i: int) -> httpx.Response:
+        token = self.verification_tokens[i % len(self.verification_tokens)]
+        return await self.client.get(f"/auth/verify/{token}")
+
+    async def run(self, endpoints: List[str]) -> Dict[str, Dict[str, Any]]:
+        await self.setup()
+
+        results = {}
+        for name in ENDPOINTS:
+            if name not in endpoints:
+                continue
+            if name == "verify" and not self.registered:
+                # verify needs unverified accounts, register some unmeasured.
+                await measure(
+                    self.requests + self.warmup, self.concurrency, self.register, 201
+                )
+
+            if name == "verify":
+                # signing tokens is client work, keep it out of the timings.
+                self.verification_tokens = [
+                    self._verification_token(email) for email in self.registered
+                ]
+
+            send = getattr(self, name)
+            expected = 201 if name == "register" else 200
+            if self.warmup:
+                await measure(self.warmup, self.concurrency, send, expected)
+            if name == "verify":
+                # warmup verified the first accounts, start from fresh ones.
+                self.verification_tokens = self.verification_tokens[self.warmup :]
+            results[name] = await measure(
+                self.requests, self.concurrency, send, expected
+            )
+            print(
+                f"{name:<10} {results[name]['throughput_rps']:>9.2f} req/s  "
+                f"p50 {results[name]['p50_ms']:>8.2f} ms  "
+                f"p95 {results[name]['p95_ms']:>8.2f} ms  "
+                f"p99 {results[name]['p99_ms']:>8.2f} ms  "
+                f"errors {results[name]['errors']}"
+            )
+        return results
@@ -0,0 +1,131 @@
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+# bump when the result layout changes, `compare` refuses mixed versions.
+FORMAT_VERSION = 1
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(fraction * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(
+    latencies: List[float], failures: Dict[str, int], seconds: float
+) -> Dict[str, Any]:
+    """
+    Args:
+        latencies (List[float]): per request latency of successful requests, seconds
+        failures (Dict[str, int]): failed requests per status code or error
+        seconds (float): wall time of the whole run
+
+    Returns:
+        Dict[str, Any]: throughput and latency percentiles in milliseconds
+    """
+    ordered = sorted(latencies)
+    errors = sum(failures.values())
+    return {
+        "requests": len(ordered) + errors,
+        "errors": errors,
+        "failures": dict(sorted(failures.items())),
+        "seconds": round(seconds, 4),
+        "throughput_rps": round(len(ordered) / seconds, 2) if seconds else 0.0,
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 0.50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 0.95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 0.99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=False
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD") or None,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def build_report(
+    config: Dict[str, Any], endpoints: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
+    return {
+        "format": FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "endpoints": endpoints,
+    }
+
+
+def write_report(report: Dict[str, Any], path: str):
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def load_report(path: str) -> Dict[str, Any]:
+    with open(path) as file:
+        report = json.load(file)
+    if report.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported benchmark format {report.get('format')}")
+    return report
+
+
+def compare(
+    base: Dict[str, Any], head: Dict[str, Any], threshold: float
+) -> Tuple[List[str], bool]:
+    """
+    compare two reports endpoint by endpoint.
+
+    an endpoint regresses when its p95 grows, or its throughput drops, by
+    more than `threshold` (a fraction), or when it starts failing requests.
+
+    Returns:
+        Tuple[List[str], bool]: printable lines, and whether anything regressed
+    """
+    lines = []
+    regressed = False
+    for name, before in sorted(base["endpoints"].items()):
+        after = head["endpoints"].get(name)
+        if after is None:
+            lines.append(f"{name:<10} missing from head")
+            continue
+
+        p95_change = _change(before["p95_ms"], after["p95_ms"])
+        rps_change = _change(before["throughput_rps"], after["throughput_rps"])
+        bad = (
+            p95_change > threshold
+            or rps_change < -threshold
+            or (after["errors"] > 0 and before["errors"] == 0)
+        )
+        regressed = regressed or bad
+        lines.append(
+            f"{name:<10} p95 {before['p95_ms']:>9.2f} -> {after['p95_ms']:>9.2f} ms "
+            f"({p95_change:+.1%})  "
+            f"rps {before['throughput_rps']:>9.2f} -> {after['throughput_rps']:>9.2f} "
+            f"({rps_change:+.1%})  errors {after['errors']}"
+            + ("  REGRESSED" if bad else "")
+        )
+    return lines, regressed
+
+
+def _change(before: float, after: float) -> float:
+    if not before:
+        return 0.0
+    return (after - before) / before
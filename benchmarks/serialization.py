@@ -0,0 +1,119 @@
+import json
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from models.auth import TokenModel, UserResponseModel
+from schemas import Users
+from utils.responses import FastJSONResponse, message
+
+ACCESS_TOKEN = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "a" * 120 + ".sig"
+REFRESH_TOKEN = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "b" * 120 + ".sig"
+
+
+def user_row() -> Users:
+    now = datetime.now()
+    return Users(
+        id=42,
+        name="bench user",
+        email="bench@example.com",
+        password="$2b$12$" + "x" * 53,
+        avatar="",
+        created_at=now,
+        updated_at=now,
+        is_verified=True,
+    )
+
+
+def build_cases() -> Dict[str, Dict[str, Callable[[], Awaitable[bytes]]]]:
+    """
+    per response, the default FastAPI path the routes used to take and the
+    direct path they take now. both return the rendered body.
+    """
+    row = user_row()
+    cached = UserResponseModel(**row.__dict__)
+    user_field = create_model_field("me", UserResponseModel, mode="serialization")
+    token_field = create_model_field("token", TokenModel, mode="serialization")
+
+    async def me_row_default() -> bytes:
+        user = UserResponseModel(**row.__dict__)
+        content = await serialize_response(field=user_field, response_content=user)
+        return JSONResponse(content).body
+
+    async def me_row_fast() -> bytes:
+        user = UserResponseModel.model_construct(
+            **{name: getattr(row, name) for name in UserResponseModel.model_fields}
+        )
+        return FastJSONResponse(user).body
+
+    async def me_cached_default() -> bytes:
+        content = await serialize_response(field=user_field, response_content=cached)
+        return JSONResponse(content).body
+
+    async def me_cached_fast() -> bytes:
+        return FastJSONResponse(cached).body
+
+    async def tokens_default() -> bytes:
+        tokens = {"access_token": ACCESS_TOKEN, "refresh_token": REFRESH_TOKEN}
+        content = await serialize_response(field=token_field, response_content=tokens)
+        return JSONResponse(content).body
+
+    async def tokens_fast() -> bytes:
+        tokens = TokenModel.model_construct(
+            access_token=ACCESS_TOKEN, refresh_token=REFRESH_TOKEN
+        )
+        return FastJSONResponse(tokens).body
+
+    async def message_default() -> bytes:
+        return JSONResponse({"message": "Email verified!"}).body
+
+    async def message_fast() -> bytes:
+        return message("Email verified!").body
+
+    return {
+        "me (db row)": {"default": me_row_default, "fast": me_row_fast},
+        "me (cached)": {"default": me_cached_default, "fast": me_cached_fast},
+        "tokens": {"default": tokens_default, "fast": tokens_fast},
+        "message": {"default": message_default, "fast": message_fast},
+    }
+
+
+async def time_path(path: Callable[[], Awaitable[bytes]], iterations: int) -> float:
+    """
+    Returns:
+        float: microseconds per call
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await path()
+    return 1e6 * (time.perf_counter() - started) / iterations
+
+
+async def measure(iterations: int, repeat: int) -> List[Dict[str, Any]]:
+    """
+    best of `repeat` runs of `iterations` calls per path, after checking
+    both paths of a case render the same document.
+    """
+    rows = []
+    for name, paths in build_cases().items():
+        default_body = await paths["default"]()
+        fast_body = await paths["fast"]()
+        if json.loads(default_body) != json.loads(fast_body):
+            raise AssertionError(f"{name}: {default_body!r} != {fast_body!r}")
+
+        default_us = min(
+            [await time_path(paths["default"], iterations) for _ in range(repeat)]
+        )
+        fast_us = min([await time_path(paths["fast"], iterations) for _ in range(repeat)])
+        rows.append(
+            {
+                "case": name,
+                "default_us": round(default_us, 2),
+                "fast_us": round(fast_us, 2),
+                "saving_us": round(default_us - fast_us, 2),
+                "speedup": round(default_us / fast_us, 2),
+            }
+        )
+    return rows
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from typing import Dict
+from aiosmtpd.controller import Controller
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SMTPSink:
+    """
+    aiosmtpd server on its own thread that accepts and counts every message.
+    """
+
+    def __init__(self, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = 0
+        self.messages = 0
+        self._controller: Controller | None = None
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        self.messages += 1
+        return "250 OK"
+
+    async def start(self):
+        self.port = free_port()
+        self._controller = Controller(self, hostname=self.host, port=self.port)
+        # blocks until the server thread is listening.
+        await asyncio.to_thread(self._controller.start)
+
+    async def stop(self):
+        if self._controller is not None:
+            await asyncio.to_thread(self._controller.stop)
+            self._controller = None
+
+    def env(self) -> Dict[str, str]:
+        return {
+            "EMAIL_SERVER": self.host,
+            "EMAIL_PORT": str(self.port),
+            "EMAIL_USE_TLS": "false",
+            "EMAIL_USE_CREDENTIALS": "false",
+        }
+
+
+class EphemeralPostgres:
+    """
+    throwaway postgres cluster in a temporary directory, trust auth on
+    localhost. needs `initdb` and `pg_ctl` on PATH or in `bin_dir`, and
+    a non-root user since postgres refuses to run as root.
+    """
+
+    def __init__(self, bin_dir: str | None = None, database: str = "onepass"):
+        self.bin_dir = bin_dir
+        self.database = database
+        self.port = free_port()
+        self.directory: str | None = None
+
+    def _bin(self, name: str) -> str:
+        if self.bin_dir:
+            return os.path.join(self.bin_dir, name)
+        path = shutil.which(name)
+        if path is None:
+            raise RuntimeError(f"{name} not found, pass --pg-bin or --database-url.")
+        return path
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix="onepass-bench-")
+        data = os.path.join(self.directory, "data")
+        subprocess.run(
+            [self._bin("initdb"), "-D", data, "-U", "postgres", "-A", "trust"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        options = (
+            f"-p {self.port} -k {self.directory} -c listen_addresses=127.0.0.1 "
+            "-c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        )
+        subprocess.run(
+            [
+                self._bin("pg_ctl"),
+                "-D",
+                data,
+                "-o",
+                options,
+                "-l",
+                os.path.join(self.directory, "postgres.log"),
+                "-w",
+                "start",
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [
+                self._bin("createdb"),
+                "-h",
+                "127.0.0.1",
+                "-p",
+                str(self.port),
+                "-U",
+                "postgres",
+                self.database,
+            ],
+            check=True,
+        )
+
+    def stop(self):
+        if self.directory is None:
+            return
+        subprocess.run(
+            [
+                self._bin("pg_ctl"),
+                "-D",
+                os.path.join(self.directory, "data"),
+                "-m",
+                "immediate",
+                "-w",
+                "stop",
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+    def env(self) -> Dict[str, str]:
+        return {
+            "DB_NAME": self.database,
+            "DB_USER": "postgres",
+            "DB_PWD": "postgres",
+            "DB_HOSTNAME": f"127.0.0.1:{self.port}",
+        }
@@ -0,0 +1,83 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# imports main in a fresh interpreter with no configuration at all, so it
+# also checks that importing the app needs neither settings nor a database.
+IMPORT_PROBE = """
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+"""
+
+
+def measure_import(repeat: int) -> List[float]:
+    """
+    Returns:
+        List[float]: seconds to `import main`, one fresh process per sample
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {"PATH": os.environ.get("PATH", "")}
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=root,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"importing main failed:\n{result.stderr}")
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+async def measure_lifespan(repeat: int) -> Dict[str, List[float]]:
+    """
+    enter and leave the app lifespan `repeat` times, the settings and the
+    database must already be configured in the environment.
+
+    Returns:
+        Dict[str, List[float]]: startup and shutdown seconds per sample
+    """
+    from main import app
+
+    samples = {"startup": [], "shutdown": []}
+    for _ in range(repeat):
+        lifespan = app.router.lifespan_context(app)
+        started = time.perf_counter()
+        await lifespan.__aenter__()
+        samples["startup"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await lifespan.__aexit__(None, None, None)
+        samples["shutdown"].append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "median_ms": round(1000 * statistics.median(samples), 1),
+        "min_ms": round(1000 * min(samples), 1),
+        "max_ms": round(1000 * max(samples), 1),
+        "samples": len(samples),
+    }
+
+
+def check_budgets(
+    results: Dict[str, Dict[str, Any]], budgets: Dict[str, float]
+) -> List[str]:
+    """
+    Returns:
+        List[str]: one line per measurement whose median is over its budget
+    """
+    return [
+        f"{name} median {results[name]['median_ms']} ms exceeds budget {budget} ms"
+        for name, budget in budgets.items()
+        if budget and results[name]["median_ms"] > budget
+    ]
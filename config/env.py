@@ -1,48 +1,196 @@
-from os import environ
-from dotenv import load_dotenv
-from enum import Enum
+from functools import lru_cache
+from typing import List, Literal, Optional
+from pydantic import Field, IPvAnyNetwork, model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-load_dotenv(),
 
+class Settings(BaseSettings):
+    """
+    application configuration, read from the environment and `.env`.
+
+    nothing reads it at import time; `get_settings` validates it once, on
+    first use, which for the app is the start of the lifespan.
+    """
+
+    # secrets must not end up in validation errors and startup logs.
+    model_config = SettingsConfigDict(
+        env_file=".env", extra="ignore", hide_input_in_errors=True
+    )
 
-OnepassEnvs = {
     # Environment
-    "ENV": environ.get("ENV", "development"),
+    ENV: str = "development"
+
     # Database
-    "DB_NAME": environ.get("DB_NAME"),
-    "DB_USER": environ.get("DB_USER"),
-    "DB_HOSTNAME": environ.get("DB_HOSTNAME"),
-    "DB_PWD": environ.get("DB_PWD"),
+    DB_NAME: str
+    DB_USER: str
+    DB_HOSTNAME: str
+    DB_PWD: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_STATEMENT_TIMEOUT_MS: int = 5000
+    # read replicas as a JSON list of postgresql:// urls. read-only auth
+    # lookups use a replica that is at most MAX_LAG behind the primary.
+    DB_REPLICA_URLS: List[str] = []
+    DB_REPLICA_MAX_LAG_SECONDS: float = 2.0
+    DB_REPLICA_CHECK_SECONDS: float = 2.0
+
     # Auth Envs
-    "ACCESS_TOKEN_SECRET_KEY": environ.get("ACCESS_TOKEN_SECRET_KEY"),
-    "REFRESH_TOKEN_SECRET_KEY": environ.get("REFRESH_TOKEN_SECRET_KEY"),
-    "EMAIL_VERIFICATION_TOKEN_SECRET_KEY": environ.get(
-        "EMAIL_VERIFICATION_TOKEN_SECRET_KEY", ""
-    ),
-    "PASSWORD_RESET_TOKEN_SECRET_KEY": environ.get(
-        "PASSWORD_RESET_TOKEN_SECRET_KEY", ""
-    ),
-    "ALGORITHM": environ.get("ALGORITHM", "HS256"),
-    "ACCESS_TOKEN_EXP_MINUTES": int(
-        environ.get("ACCESS_TOKEN_EXP_MINUTES"),
-    ),
-    "REFRESH_TOKEN_EXP_MINUTES": int(
-        environ.get("REFRESH_TOKEN_EXP_MINUTES"),
-    ),
-    "EMAIL_VERIFICATION_EXP_MINUTES": int(
-        environ.get("EMAIL_VERIFICATION_EXP_MINUTES"),
-    ),
-    "PASSWORD_RESET_EXP_MINUTES": int(
-        environ.get("PASSWORD_RESET_EXP_MINUTES"),
-    ),
+    # only used with ACCESS_TOKEN_ALGORITHM=HS256. when set under ES256,
+    # access tokens without a `kid` (issued before the switch) still verify.
+    ACCESS_TOKEN_SECRET_KEY: str = ""
+    REFRESH_TOKEN_SECRET_KEY: str
+    EMAIL_VERIFICATION_TOKEN_SECRET_KEY: str = ""
+    PASSWORD_RESET_TOKEN_SECRET_KEY: str = ""
+    ALGORITHM: str = "HS256"
+    ACCESS_TOKEN_EXP_MINUTES: int
+    REFRESH_TOKEN_EXP_MINUTES: int
+    EMAIL_VERIFICATION_EXP_MINUTES: int
+    PASSWORD_RESET_EXP_MINUTES: int
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60
+    REVOCATION_SYNC_SECONDS: float = 5
+
+    # Access token signing keys, ES256 keys live in the signing_keys table,
+    # rotate on their own and are served at /.well-known/jwks.json. a new key
+    # is published PUBLISH_AHEAD seconds before it signs anything.
+    ACCESS_TOKEN_ALGORITHM: Literal["ES256", "HS256"] = "ES256"
+    # Fernet keys (`Fernet.generate_key()`) encrypting the private keys in the
+    # table, as a JSON list. the first encrypts, all of them decrypt; keep a
+    # replaced key listed until the keys it encrypted have retired.
+    JWT_KEY_ENCRYPTION_KEYS: List[str] = []
+    JWT_KEY_ROTATION_DAYS: float = 30
+    JWT_KEY_PUBLISH_AHEAD_SECONDS: float = 3600
+    JWT_KEY_SYNC_SECONDS: float = 60
+    JWKS_MAX_AGE_SECONDS: int = 600
+    TOKEN_CACHE_SIZE: int = 50000
+
+    # Vault
+    VAULT_MAX_ITEM_BYTES: int = 65536
+    VAULT_SYNC_PAGE_SIZE: int = 500
+    # one upsert per batch binds 7 parameters a row, postgres allows 32767.
+    VAULT_IMPORT_BATCH_SIZE: int = Field(default=1000, ge=1, le=4000)
+    # the import transaction starts after the upload, a client cannot keep
+    # it open, this only bounds gaps between its own statements.
+    VAULT_IMPORT_IDLE_TIMEOUT_MS: int = 5000
+    VAULT_EXPORT_BATCH_SIZE: int = 1000
+
+    # Rate limits, requests per minute for login and per hour otherwise
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_LOGIN_PER_IP: int = 20
+    RATE_LIMIT_LOGIN_PER_EMAIL: int = 5
+    RATE_LIMIT_REGISTER_PER_IP: int = 20
+    RATE_LIMIT_MAIL_PER_IP: int = 20
+    RATE_LIMIT_MAIL_PER_EMAIL: int = 5
+    # reverse proxies in front of the app as a JSON list of addresses or
+    # networks, e.g. '["10.0.0.0/8"]' on Render. for requests from them the
+    # client ip is read from X-Forwarded-For; empty trusts the peer address.
+    TRUSTED_PROXIES: List[IPvAnyNetwork] = []
+
+    # Email deliverability checks
+    EMAIL_DELIVERABILITY_CHECKS: bool = True
+    DNS_CACHE_SIZE: int = 10000
+    DNS_CACHE_TTL_SECONDS: float = 3600
+    DNS_ERROR_TTL_SECONDS: float = 60
+    DNS_TIMEOUT_SECONDS: float = 2.0
+
     # Email Envs
-    "EMAIL_USERNAME": environ.get("EMAIL_USERNAME"),
-    "EMAIL_PASSWORD": environ.get("EMAIL_PASSWORD"),
-    "EMAIL_PORT": int(
-        environ.get("EMAIL_PORT"),
-    ),
-    "EMAIL_FROM_NAME": environ.get("EMAIL_FROM_NAME"),
-    "EMAIL_SERVER": environ.get("EMAIL_SERVER"),
-    "EMAIL_FROM": environ.get("EMAIL_FROM"),
-    "EMAIL_USE_TLS": True,
-}
+    EMAIL_USERNAME: str
+    EMAIL_PASSWORD: str
+    EMAIL_PORT: int
+    EMAIL_FROM_NAME: Optional[str] = None
+    EMAIL_SERVER: str
+    EMAIL_FROM: str
+    EMAIL_USE_TLS: bool = True
+    EMAIL_USE_CREDENTIALS: bool = True
+    MAIL_CONNECTIONS: int = 2
+    MAIL_BATCH_SIZE: int = 20
+    MAIL_QUEUE_SIZE: int = 1000
+    MAIL_MAX_RETRIES: int = 3
+    MAIL_RETRY_BACKOFF_SECONDS: float = 1.0
+    OUTBOX_BATCH_SIZE: int = 50
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 2.0
+    OUTBOX_LEASE_SECONDS: float = 300
+    OUTBOX_MAX_ATTEMPTS: int = 5
+    OUTBOX_RETRY_BACKOFF_SECONDS: float = 30
+
+    # Admission control, in-flight requests per route class plus a bounded
+    # queue; requests still waiting after the timeout get a 503.
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_HEAVY_CONCURRENCY: int = 32
+    ADMISSION_HEAVY_QUEUE: int = 128
+    ADMISSION_HEAVY_TIMEOUT_SECONDS: float = 2.0
+    ADMISSION_TRANSFER_CONCURRENCY: int = 8
+    ADMISSION_TRANSFER_QUEUE: int = 16
+    ADMISSION_TRANSFER_TIMEOUT_SECONDS: float = 2.0
+    ADMISSION_LIGHT_CONCURRENCY: int = 256
+    ADMISSION_LIGHT_QUEUE: int = 1024
+    ADMISSION_LIGHT_TIMEOUT_SECONDS: float = 1.0
+
+    # Audit log, events are queued in memory and COPYed in batches; once
+    # AUDIT_MAX_QUEUE are waiting, callers start a flush and wait up to
+    # AUDIT_BLOCK_SECONDS for room, then the event is dropped. partitions
+    # older than the retention (in months, 0 keeps everything) are dropped.
+    AUDIT_ENABLED: bool = True
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_MAX_QUEUE: int = 10000
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_BLOCK_SECONDS: float = 0.5
+    AUDIT_RETENTION_MONTHS: int = 13
+    AUDIT_ACTIVITY_PAGE_SIZE: int = 50
+
+    # Metrics
+    METRICS_ENABLED: bool = True
+
+    # Password hashing
+    PWD_HASH_WORKERS: int = 0
+    PWD_HASH_MAX_QUEUE: int = 64
+    PWD_HASH_QUEUE_TIMEOUT_SECONDS: float = 2.0
+    # bcrypt or argon2 (argon2id), older hashes are upgraded on login
+    PWD_HASH_SCHEME: Literal["bcrypt", "argon2"] = "bcrypt"
+    # per-hash latency budget, calibrates the cost below at startup; 0 keeps it
+    PWD_HASH_TARGET_MS: float = 0
+    PWD_HASH_BCRYPT_ROUNDS: int = 12
+    PWD_HASH_ARGON2_TIME_COST: int = 3
+    PWD_HASH_ARGON2_MEMORY_KIB: int = 65536
+    PWD_HASH_ARGON2_PARALLELISM: int = 1
+    # index built by `python -m tools.build_breach_index`, new passwords found
+    # in it are rejected; empty disables the check
+    BREACHED_PASSWORDS_PATH: str = ""
+
+    @model_validator(mode="after")
+    def check_access_token_keys(self) -> "Settings":
+        if self.ACCESS_TOKEN_ALGORITHM == "HS256" and not self.ACCESS_TOKEN_SECRET_KEY:
+            raise ValueError("ACCESS_TOKEN_SECRET_KEY is required with HS256")
+        if self.ACCESS_TOKEN_ALGORITHM == "ES256" and not self.JWT_KEY_ENCRYPTION_KEYS:
+            raise ValueError("JWT_KEY_ENCRYPTION_KEYS is required with ES256")
+        # every node and JWKS cache must see a new key before it signs.
+        if self.JWT_KEY_PUBLISH_AHEAD_SECONDS < (
+            self.JWT_KEY_SYNC_SECONDS + self.JWKS_MAX_AGE_SECONDS
+        ):
+            raise ValueError(
+                "JWT_KEY_PUBLISH_AHEAD_SECONDS must cover "
+                "JWT_KEY_SYNC_SECONDS + JWKS_MAX_AGE_SECONDS"
+            )
+        return self
+
+    @property
+    def base_url(self) -> str:
+        """
+        public url of this server, used in emailed links.
+        """
+        if self.ENV == "development":
+            return "http://localhost:8000"
+        return "https://ops-staging.onrender.com"
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """
+    the validated settings, built on first call.
+
+    Raises:
+        pydantic.ValidationError: listing every missing or malformed setting.
+    """
+    return Settings()
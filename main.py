@@ -1,23 +1,66 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import BackgroundTasks, FastAPI
-from datetime import datetime
 from routers import emails
 from fastapi.staticfiles import StaticFiles
 from routers import auth
-from utils.db import engine, SQLModel
-from routers.emails import templates
+from routers import vault
+from routers import metrics
+from routers import jwks
+from utils.db import close_db, init_db
+from utils.hashing import get_password_hasher
+from utils.mail import get_mail_dispatcher
+from utils.templates import mail_templates
+from utils.outbox import get_outbox_dispatcher
+from utils.revocation import get_revocations
+from utils.keyring import get_key_ring
+from utils.audit import get_audit_log
+from utils.breach import get_breach_index
 
 from fastapi.middleware.cors import CORSMiddleware
 from constants import origins
+from config.env import get_settings
+from utils.admission import AdmissionMiddleware
+from utils.metrics import MetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # validate the whole configuration up front, failing before any i/o.
+    settings = get_settings()
+    mail_templates.load()
+    # open the breach index now, so a bad path fails startup.
+    get_breach_index()
+    await init_db()
+    await get_audit_log().start()
+    await get_revocations().start()
+    if settings.ACCESS_TOKEN_ALGORITHM == "ES256":
+        await get_key_ring().start()
+    get_password_hasher().start()
+    await get_mail_dispatcher().start()
+    await get_outbox_dispatcher().start()
+    yield
+    # mail that cannot be sent in time fails, and the outbox puts it back.
+    await asyncio.gather(get_outbox_dispatcher().stop(), get_mail_dispatcher().stop())
+    get_password_hasher().shutdown()
+    await get_key_ring().stop()
+    await get_revocations().stop()
+    # after everything that records events, flushes what is still queued.
+    await get_audit_log().stop()
+    await close_db()
+
 
-SQLModel.metadata.create_all(engine)
 app = FastAPI(
     title="onePass server",
     description="onePass is a password manager server.",
     version="0.0.1",
+    lifespan=lifespan,
 )
 
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# innermost, so shed requests still get CORS headers and are timed.
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -25,16 +68,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-
-# Add global context processor
-@app.middleware("http")
-async def add_global_context(request, call_next):
-    response = await call_next(request)
-    templates.env.globals["copyright_text"] = (
-        f"Copyright © {datetime.now().year}. FluxTech, All rights reserved."
-    )
-    return response
+# added last so it is outermost and times the whole stack.
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
@@ -56,3 +91,6 @@ async def send_notification(email: str, background_tasks: BackgroundTasks):
 
 app.include_router(auth.router)
 app.include_router(emails.router)
+app.include_router(vault.router)
+app.include_router(metrics.router)
+app.include_router(jwks.router)
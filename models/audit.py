@@ -0,0 +1,25 @@
+from enum import Enum
+from datetime import datetime
+from typing import List
+from pydantic import BaseModel
+
+
+class AuditEventType(str, Enum):
+    LOGIN = "login"
+    LOGIN_FAILED = "login_failed"
+    PASSWORD_RESET = "password_reset"
+    EMAIL_VERIFIED = "email_verified"
+    TOKEN_REFRESH = "token_refresh"
+
+
+class AuditEventModel(BaseModel):
+    event: AuditEventType
+    created_at: datetime
+    ip: str | None
+    user_agent: str | None
+
+
+class AuditActivityModel(BaseModel):
+    events: List[AuditEventModel]
+    cursor: str | None
+    has_more: bool
@@ -1,10 +1,21 @@
 from enum import Enum
+from typing import ClassVar
 from pydantic import BaseModel, field_validator
 from datetime import datetime
 from email_validator import validate_email, EmailNotValidError, EmailSyntaxError
+from schemas.users import normalize_email
+from utils.breach import ensure_not_breached
+
+
+# validators only check syntax, DNS lookups would block request parsing.
+# models with CHECK_DELIVERABILITY set get an async, cached domain check in
+# their route via utils.deliverability. the breached password check is a
+# local mmap lookup, cheap enough to run while parsing.
 
 
 class RegisterModel(BaseModel):
+    CHECK_DELIVERABILITY: ClassVar[bool] = True
+
     name: str
     email: str
     password: str
@@ -13,13 +24,20 @@ class RegisterModel(BaseModel):
     @classmethod
     def validate_email(cls, value):
         try:
-            validatedEmail = validate_email(value)
-            return validatedEmail.email
+            validatedEmail = validate_email(value, check_deliverability=False)
+            return normalize_email(validatedEmail.email)
         except EmailNotValidError:
             raise EmailSyntaxError("Invalid Email format")
 
+    @field_validator("password")
+    @classmethod
+    def validate_password(cls, value):
+        return ensure_not_breached(value)
+
 
 class LoginModel(BaseModel):
+    CHECK_DELIVERABILITY: ClassVar[bool] = False
+
     email: str
     password: str
 
@@ -27,21 +45,23 @@ class LoginModel(BaseModel):
     @classmethod
     def validate_email(cls, value):
         try:
-            validatedEmail = validate_email(value)
-            return validatedEmail.email
+            validatedEmail = validate_email(value, check_deliverability=False)
+            return normalize_email(validatedEmail.email)
         except EmailNotValidError:
             raise EmailSyntaxError("Invalid Email format")
 
 
 class ForgotPwdModel(BaseModel):
+    CHECK_DELIVERABILITY: ClassVar[bool] = False
+
     email: str
 
     @field_validator("email")
     @classmethod
     def validate_email(cls, value):
         try:
-            validatedEmail = validate_email(value)
-            return validatedEmail.email
+            validatedEmail = validate_email(value, check_deliverability=False)
+            return normalize_email(validatedEmail.email)
         except EmailNotValidError:
             raise EmailSyntaxError("Invalid Email format")
 
@@ -49,6 +69,15 @@ class ForgotPwdModel(BaseModel):
 class ResetPwdModel(BaseModel):
     password: str
 
+    @field_validator("password")
+    @classmethod
+    def validate_password(cls, value):
+        return ensure_not_breached(value)
+
+
+class LogoutModel(BaseModel):
+    refresh_token: str | None = None
+
 
 class UserResponseModel(BaseModel):
     id: int
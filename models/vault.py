@@ -0,0 +1,65 @@
+from base64 import b64decode, b64encode
+from binascii import Error as Base64Error
+from datetime import datetime
+from typing import List
+from pydantic import BaseModel, field_validator
+from config.env import get_settings
+
+
+class VaultItemWriteModel(BaseModel):
+    data: str
+
+    @staticmethod
+    def max_bytes() -> int:
+        return get_settings().VAULT_MAX_ITEM_BYTES
+
+    @field_validator("data")
+    @classmethod
+    def validate_data(cls, value):
+        try:
+            blob = b64decode(value, validate=True)
+        except Base64Error:
+            raise ValueError("data must be base64 encoded")
+
+        max_bytes = cls.max_bytes()
+        if len(blob) > max_bytes:
+            raise ValueError(f"data must be at most {max_bytes} bytes")
+        return value
+
+    def blob(self) -> bytes:
+        return b64decode(self.data)
+
+
+class VaultItemModel(BaseModel):
+    uid: str
+    data: str
+    revision: int
+    deleted: bool
+    updated_at: datetime
+
+    @classmethod
+    def from_row(cls, row) -> "VaultItemModel":
+        return cls(
+            uid=row.uid,
+            data=b64encode(row.blob).decode(),
+            revision=row.revision,
+            deleted=row.deleted,
+            updated_at=row.updated_at,
+        )
+
+
+class VaultRevisionModel(BaseModel):
+    uid: str
+    revision: int
+    updated_at: datetime
+
+
+class VaultSyncModel(BaseModel):
+    items: List[VaultItemModel]
+    cursor: int
+    has_more: bool
+
+
+class VaultImportModel(BaseModel):
+    imported: int
+    cursor: int
@@ -5,10 +5,11 @@ from fastapi import (
     status,
     HTTPException,
     Query,
-    BackgroundTasks,
+    Request,
 )
-from fastapi.responses import JSONResponse
-from sqlmodel import Session, select
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime
 from models.auth import (
     TokenModel,
@@ -18,17 +19,51 @@ from models.auth import (
     TokenTypeModel,
     UserResponseModel,
     LoginModel,
+    LogoutModel,
 )
+from models.audit import AuditActivityModel, AuditEventModel, AuditEventType
 
 from models.emails import EmailTypes, EmailModel
-from utils.db import get_db
+from utils.db import async_session, get_db, get_read_db, read_one, read_one_from
+from utils.audit import decode_cursor, encode_cursor, get_audit_log
 from utils.authentication import Authentication
+from utils.deliverability import get_email_deliverability
+from utils.ratelimit import (
+    LOGIN_EMAIL_LIMIT,
+    LOGIN_IP_LIMIT,
+    MAIL_EMAIL_LIMIT,
+    MAIL_IP_LIMIT,
+    REGISTER_IP_LIMIT,
+    per_email,
+    per_ip,
+)
 
-from utils.mail import send_mail_in_background
-from schemas import Users
-from constants import base_url
+from utils.outbox import get_outbox_dispatcher
+from utils.responses import (
+    FastJSONResponse,
+    etag_headers,
+    if_none_match,
+    make_etag,
+    message,
+    not_modified,
+)
+from schemas import (
+    EmailOutbox,
+    Users,
+    email_matches,
+    normalize_email,
+    insert_user_if_absent,
+    rehash_user_password,
+    select_user_activity,
+    select_user_by_email,
+    set_user_password,
+    verify_user_by_email,
+)
+from config.env import get_settings
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(
+    prefix="/auth", tags=["auth"], default_response_class=FastJSONResponse
+)
 auth_handler = Authentication()
 
 
@@ -50,89 +85,202 @@ def get_tokens(email: str) -> TokenModel:
         TokenTypeModel.REFRESH_TOKEN, {"email": email}
     )
 
-    content: TokenModel = {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-    }
-
-    return content
+    # both fields are freshly signed strings, nothing to validate.
+    return TokenModel.model_construct(
+        access_token=access_token, refresh_token=refresh_token
+    )
 
 
 @router.get("/me", response_model=UserResponseModel)
-async def me(user: UserResponseModel = Depends(auth_handler.get_me)):
+async def me(
+    request: Request, user: UserResponseModel = Depends(auth_handler.get_me)
+):
+    """
+    user endpoint function, 304 when If-None-Match has the current ETag.
+    every write to a user sets updated_at, so it versions the whole body.
     """
-    user endpoint function
+    etag = make_etag("me", user.id, user.updated_at)
+    if if_none_match(request, etag):
+        return not_modified(etag)
+    return FastJSONResponse(user, headers=etag_headers(etag))
+
+
+@router.get("/activity", response_model=AuditActivityModel)
+async def activity(
+    cursor: str | None = Query(default=None, description="cursor of the last page."),
+    limit: int = Query(default=20, ge=1),
+    user: UserResponseModel = Depends(auth_handler.get_me),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    the user's security events, newest first. pass the returned `cursor`
+    back as `cursor` for the next page. events show up once the audit log
+    has flushed them.
     """
-    return user
+    limit = min(limit, get_settings().AUDIT_ACTIVITY_PAGE_SIZE)
+    last = decode_cursor(cursor) if cursor else None
+    statement = select_user_activity(user.id, last, limit + 1)
+    rows = (await db.exec(statement=statement)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return FastJSONResponse(
+        AuditActivityModel.model_construct(
+            events=[
+                AuditEventModel.model_construct(
+                    event=row.event,
+                    created_at=row.created_at,
+                    ip=row.ip,
+                    user_agent=row.user_agent,
+                )
+                for row in rows
+            ],
+            cursor=next_cursor,
+            has_more=has_more,
+        )
+    )
 
 
-@router.post("/login", status_code=status.HTTP_200_OK, response_model=TokenModel)
-async def login(user_cred: LoginModel, db: Session = Depends(get_db)):
+@router.post("/logout", status_code=status.HTTP_200_OK)
+async def logout(
+    body: LogoutModel | None = Body(default=None),
+    token: HTTPAuthorizationCredentials = Depends(auth_handler.auth_scheme),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    revoke the bearer access token and, when given, its refresh token.
+    """
+    claims = auth_handler.decode_claims(
+        token.credentials, TokenTypeModel.ACCESS_TOKEN, credential_exception=None
+    )
+    auth_handler.revoke_token(db, claims)
+
+    if body is not None and body.refresh_token:
+        refresh_claims = auth_handler.decode_claims(
+            body.refresh_token,
+            TokenTypeModel.REFRESH_TOKEN,
+            credential_exception=None,
+        )
+        if refresh_claims["email"] != claims["email"]:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token!"
+            )
+        auth_handler.revoke_token(db, refresh_claims)
+
+    await db.commit()
+    return message("Logged out!")
+
+
+@router.post(
+    "/login",
+    status_code=status.HTTP_200_OK,
+    response_model=TokenModel,
+    dependencies=[Depends(per_ip("login", LOGIN_IP_LIMIT))],
+)
+async def login(
+    request: Request, user_cred: LoginModel, db: AsyncSession = Depends(get_read_db)
+):
     """
     user login endpoint function.
     """
-    email = user_cred.email.lower()
-    statement = select(Users).where(Users.email == email)
-    result = db.exec(statement=statement).one_or_none()
+    audit = get_audit_log()
+    await per_email("login", user_cred.email, LOGIN_EMAIL_LIMIT)
+    statement = select_user_by_email(user_cred.email)
+    # a replica may not have seen a register or verify from just now.
+    result, from_replica = await read_one_from(
+        db, statement, recheck=lambda row: row is None or not row.is_verified
+    )
 
     if result:
         if result.is_verified:
-            if auth_handler.verify_pwd(user_cred.password, result.password):
-                token = get_tokens(result.email)
-
-                return token
-
+            verified, new_hash = await auth_handler.averify_and_update_pwd(
+                user_cred.password, result.password
+            )
+            if not verified and from_replica:
+                # or a password reset, verify again only if the hash moved.
+                current = await read_one(db, statement, fresh=True)
+                if current is not None and current.password != result.password:
+                    result = current
+                    verified, new_hash = await auth_handler.averify_and_update_pwd(
+                        user_cred.password, result.password
+                    )
+            if verified:
+                if new_hash is not None:
+                    async with async_session() as primary:
+                        await primary.exec(
+                            statement=rehash_user_password(
+                                result.id, result.password, new_hash
+                            )
+                        )
+                        await primary.commit()
+                await audit.record(
+                    AuditEventType.LOGIN, request, result.email, result.id
+                )
+                return FastJSONResponse(get_tokens(result.email))
+
+            await audit.record(
+                AuditEventType.LOGIN_FAILED, request, result.email, result.id
+            )
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password!",
             )
 
+        await audit.record(
+            AuditEventType.LOGIN_FAILED, request, result.email, result.id
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email has not been verified yet.",
         )
 
+    await audit.record(AuditEventType.LOGIN_FAILED, request, user_cred.email)
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="user doesn't exist!",
     )
 
 
-@router.post("/register", status_code=status.HTTP_201_CREATED, response_model=str)
-def register(
-    background_tasks: BackgroundTasks,
+@router.post(
+    "/register",
+    status_code=status.HTTP_201_CREATED,
+    response_model=str,
+    dependencies=[Depends(per_ip("register", REGISTER_IP_LIMIT))],
+)
+async def register(
     user: RegisterModel = Body(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Register user endpoint function.
     """
-    statement = select(Users).where(Users.email == user.email.lower())
-    result = db.exec(statement=statement)
-
-    if result.first():
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Account with this email already exists!",
-        )
+    await per_email("register", user.email, MAIL_EMAIL_LIMIT)
+    if user.CHECK_DELIVERABILITY:
+        await get_email_deliverability().ensure(user.email)
 
-    secret_pwd = auth_handler.get_pwd_hash(user.password)
-    curr_date = datetime.now()
-    new_user = Users(
+    secret_pwd = await auth_handler.aget_pwd_hash(user.password)
+    statement = insert_user_if_absent(
         name=user.name.lower(),
-        email=user.email.lower(),
+        email=user.email,
         password=secret_pwd,
-        created_at=curr_date,
-        updated_at=curr_date,
+        curr_date=datetime.now(),
     )
+    user_id = (await db.exec(statement=statement)).scalar_one_or_none()
 
-    db.add(new_user)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Account with this email already exists!",
+        )
 
     # Generate email verification link
     verification_token = auth_handler.generate_token(
         TokenTypeModel.EMAIL_VERIFICATION_TOKEN, {"email": user.email}
     )
-    link = f"{base_url}/auth/verify/{verification_token}"
+    link = f"{get_settings().base_url}/auth/verify/{verification_token}"
 
     email_data = EmailModel(
         subject=EmailTypes.REGISTRATION.subject,
@@ -141,33 +289,35 @@ def register(
         template_name=EmailTypes.REGISTRATION.template,
     )
 
-    print("Sending email with template.")
-    send_mail_in_background(background_tasks, email_data)
-    db.commit()
-    return JSONResponse(
-        status_code=status.HTTP_201_CREATED,
-        content={"message": "A link has been sent to your mail for verification."},
+    db.add(EmailOutbox.from_email(email_data))
+    await db.commit()
+    get_outbox_dispatcher().notify()
+    return message(
+        "A link has been sent to your mail for verification.", status.HTTP_201_CREATED
     )
 
 
-@router.post("/forgot_pwd", status_code=status.HTTP_200_OK)
+@router.post(
+    "/forgot_pwd",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(per_ip("forgot_pwd", MAIL_IP_LIMIT))],
+)
 async def forgot_pwd(
-    background_tasks: BackgroundTasks,
     f_pwd: ForgotPwdModel = Body(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     forgot password endpoint function
     """
-    mail = f_pwd.email.lower()
-    statement = select(Users).where(Users.email == mail)
-    result = db.exec(statement=statement).one_or_none()
+    await per_email("forgot_pwd", f_pwd.email, MAIL_EMAIL_LIMIT)
+    statement = select_user_by_email(f_pwd.email)
+    result = (await db.exec(statement=statement)).one_or_none()
 
     if result:
         reset_token = auth_handler.generate_token(
-            TokenTypeModel.PASSWORD_RESET_TOKEN, {"email": result.email.lower()}
+            TokenTypeModel.PASSWORD_RESET_TOKEN, {"email": result.email}
         )
-        link = f"{base_url}/auth/reset_pwd/{reset_token}"
+        link = f"{get_settings().base_url}/auth/reset_pwd/{reset_token}"
 
         email_data = EmailModel(
             subject=EmailTypes.PASSWORD_RESET.subject,
@@ -176,11 +326,12 @@ async def forgot_pwd(
             template_name=EmailTypes.PASSWORD_RESET.template,
         )
 
-        send_mail_in_background(background_tasks, email_data)
-        db.commit()
-        return JSONResponse(
-            status_code=status.HTTP_201_CREATED,
-            content={"message": "A link has been sent to your mail for verification."},
+        db.add(EmailOutbox.from_email(email_data))
+        await db.commit()
+        get_outbox_dispatcher().notify()
+        return message(
+            "A link has been sent to your mail for verification.",
+            status.HTTP_201_CREATED,
         )
 
     raise HTTPException(
@@ -191,7 +342,10 @@ async def forgot_pwd(
 
 @router.patch("/reset_pwd/{token}")
 async def reset_pwd(
-    token: str, new_pwd: ResetPwdModel = Body(...), db: Session = Depends(get_db)
+    request: Request,
+    token: str,
+    new_pwd: ResetPwdModel = Body(...),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     reset password endpoint function.
@@ -200,43 +354,44 @@ async def reset_pwd(
         token, TokenTypeModel.PASSWORD_RESET_TOKEN, credential_exception=None
     )
 
-    statement = select(Users).where(Users.email == email.lower())
-    result = db.exec(statement=statement).one_or_none()
+    secret_pwd = await auth_handler.aget_pwd_hash(new_pwd.password)
+    statement = set_user_password(email, secret_pwd, datetime.now())
+    result = (await db.exec(statement=statement)).one_or_none()
 
     if result:
-        secret_pwd = auth_handler.get_pwd_hash(new_pwd.password)
-        curr_date = datetime.now()
-        result.password = secret_pwd
-        result.updated_at = curr_date
-        db.add(result)
-        db.commit()
-        db.refresh(result)
-
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={"message": "Password successfully changed!"},
+        # old sessions and this reset link stop working with the new password.
+        auth_handler.revoke_all_tokens(db, result.email)
+        await db.commit()
+        auth_handler.invalidate_user(result.email)
+        await get_audit_log().record(
+            AuditEventType.PASSWORD_RESET, request, result.email, result.id
         )
 
-    return JSONResponse(
-        status_code=status.HTTP_404_NOT_FOUND, content={"message": "Invalid token!"}
-    )
+        return message("Password successfully changed!")
+
+    return message("Invalid token!", status.HTTP_404_NOT_FOUND)
 
 
 @router.get(
     "/refresh/{token}", status_code=status.HTTP_200_OK, response_model=TokenModel
 )
-async def refresh_token(token: str, db: Session = Depends(get_db)):
+async def refresh_token(
+    request: Request, token: str, db: AsyncSession = Depends(get_read_db)
+):
     email = auth_handler.decode_token(
         token=token, token_type=TokenTypeModel.REFRESH_TOKEN, credential_exception=None
     )
 
     if email:
-        statement = select(Users).where(Users.email == email)
-        result = db.exec(statement=statement).one_or_none()
+        result = await read_one(
+            db, select_user_by_email(email), recheck=lambda row: row is None
+        )
 
         if result:
-            token = get_tokens(result.email)
-            return token
+            await get_audit_log().record(
+                AuditEventType.TOKEN_REFRESH, request, result.email, result.id
+            )
+            return FastJSONResponse(get_tokens(result.email))
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token!"
@@ -245,58 +400,59 @@ async def refresh_token(token: str, db: Session = Depends(get_db)):
 
 @router.get("/verify/{token}", status_code=status.HTTP_200_OK)
 async def acct_verification(
+    request: Request,
     token: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     email = auth_handler.decode_token(
         token, TokenTypeModel.EMAIL_VERIFICATION_TOKEN, credential_exception=None
     )
-    statement = select(Users).where(Users.email == email.lower())
-    result = db.exec(statement=statement).one_or_none()
+    statement = verify_user_by_email(email, datetime.now())
+    user_id = (await db.exec(statement=statement)).scalar_one_or_none()
+
+    if user_id is not None:
+        await db.commit()
+        auth_handler.invalidate_user(email)
+        await get_audit_log().record(
+            AuditEventType.EMAIL_VERIFIED, request, email, user_id
+        )
 
-    if result:
-        if result.is_verified:
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"message": "Email already verified"},
-            )
-        else:
-            result.is_verified = True
-            db.add(result)
-            db.commit()
-            db.refresh(result)
-
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"message": "Email verified!"},
-            )
+        return message("Email verified!")
 
-    return JSONResponse(
-        status_code=status.HTTP_404_NOT_FOUND, content={"message": "Invalid token!"}
-    )
+    # nothing updated, only the rare repeat or unknown user pays a lookup.
+    statement = select(Users.id).where(email_matches(email))
+    if (await db.exec(statement=statement)).first() is not None:
+        return message("Email already verified")
+
+    return message("Invalid token!", status.HTTP_404_NOT_FOUND)
 
 
-@router.get("/resend_verify")
+@router.get(
+    "/resend_verify",
+    dependencies=[Depends(per_ip("resend_verify", MAIL_IP_LIMIT))],
+)
 async def resend_verify(
-    background_tasks: BackgroundTasks,
     email: str = Query(description="email to resend verification."),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    statement = select(Users).where(Users.email == email.lower())
-    result = db.exec(statement=statement).one_or_none()
+    await per_email(
+        "resend_verify", normalize_email(email), MAIL_EMAIL_LIMIT
+    )
+    statement = select_user_by_email(email)
+    # only "already verified" is answered from a replica alone.
+    result, from_replica = await read_one_from(
+        db, statement, recheck=lambda row: row is None or not row.is_verified
+    )
 
     if result:
         if result.is_verified:
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"message": "Email already verified"},
-            )
+            return message("Email already verified")
         else:
             # Generate email verification link
             verification_token = auth_handler.generate_token(
-                TokenTypeModel.EMAIL_VERIFICATION_TOKEN, {"email": result.email.lower()}
+                TokenTypeModel.EMAIL_VERIFICATION_TOKEN, {"email": result.email}
             )
-            link = f"{base_url}/auth/verify/{verification_token}"
+            link = f"{get_settings().base_url}/auth/verify/{verification_token}"
 
             email_data = EmailModel(
                 subject=EmailTypes.REGISTRATION.subject,
@@ -305,14 +461,13 @@ async def resend_verify(
                 template_name=EmailTypes.REGISTRATION.template,
             )
 
-            print("Sending email with template.")
-            send_mail_in_background(background_tasks, email_data)
-            db.commit()
-            return JSONResponse(
-                status_code=status.HTTP_201_CREATED,
-                content={
-                    "message": "A link has been sent to your mail for verification."
-                },
+            async with async_session() as primary:
+                primary.add(EmailOutbox.from_email(email_data))
+                await primary.commit()
+            get_outbox_dispatcher().notify()
+            return message(
+                "A link has been sent to your mail for verification.",
+                status.HTTP_201_CREATED,
             )
 
     raise HTTPException(
@@ -1,14 +1,16 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+from utils.templates import mail_templates
 
 router = APIRouter(prefix="/emails", tags=["emails"])
 
-templates = Jinja2Templates(directory="templates")
+templates = Jinja2Templates(env=mail_templates.env)
 
 
 @router.get("/register", response_class=HTMLResponse)
 def index(request: Request):
+    mail_templates.refresh_globals()
     return templates.TemplateResponse(
         request=request,
         name="register.html",
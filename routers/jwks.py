@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from config.env import get_settings
+from utils.keyring import get_key_ring
+
+router = APIRouter(tags=["jwks"])
+
+
+@router.get("/.well-known/jwks.json")
+async def jwks():
+    """
+    public keys that verify access tokens, selected by the token's `kid`.
+    new keys appear here well before they sign anything, so caching the
+    document for JWKS_MAX_AGE_SECONDS is safe.
+    """
+    return Response(
+        content=get_key_ring().jwks(),
+        media_type="application/json",
+        headers={
+            "Cache-Control": f"public, max-age={get_settings().JWKS_MAX_AGE_SECONDS}"
+        },
+    )
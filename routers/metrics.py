@@ -0,0 +1,16 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import Response
+from config.env import get_settings
+from utils.metrics import CONTENT_TYPE, registry
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    prometheus text exposition of utils.metrics.registry.
+    """
+    if not get_settings().METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,376 @@
+import csv
+import io
+import json
+import struct
+import tempfile
+from base64 import b64encode
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, Literal, Tuple
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime
+from config.env import get_settings
+from models.auth import UserResponseModel
+from models.vault import (
+    VaultImportModel,
+    VaultItemModel,
+    VaultItemWriteModel,
+    VaultRevisionModel,
+    VaultSyncModel,
+)
+from schemas import (
+    bump_vault_revision,
+    delete_vault_item,
+    select_vault_changes,
+    select_vault_export,
+    select_vault_revision,
+    upsert_vault_items,
+)
+from utils.authentication import Authentication
+from utils.db import async_session, get_db
+from utils.responses import (
+    FastJSONResponse,
+    etag_headers,
+    if_none_match,
+    make_etag,
+    not_modified,
+)
+
+router = APIRouter(prefix="/vault", tags=["vault"])
+auth_handler = Authentication()
+
+# validated import records, (uid length, blob length) then both; the
+# spool moves to disk past SPOOL_MEMORY_BYTES.
+SPOOL_RECORD = struct.Struct("<HI")
+SPOOL_MEMORY_BYTES = 1 << 20
+
+
+@router.get("/sync", status_code=status.HTTP_200_OK, response_model=VaultSyncModel)
+async def sync(
+    request: Request,
+    since: int = Query(default=0, ge=0, description="cursor from the last sync."),
+    limit: int | None = Query(
+        default=None, ge=1, description="page size, capped at VAULT_SYNC_PAGE_SIZE."
+    ),
+    user: UserResponseModel = Depends(auth_handler.get_me),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    items changed since `since`, tombstones included, oldest change first.
+    pass the returned cursor back until has_more is false.
+
+    every vault write bumps the user's vault revision, so with `since` and
+    `limit` it versions the page: a poll with a matching If-None-Match gets
+    a 304 after one primary key lookup, and an up to date cursor an empty
+    page without scanning the items.
+    """
+    page_size = get_settings().VAULT_SYNC_PAGE_SIZE
+    limit = min(limit or page_size, page_size)
+    revision = (await db.exec(statement=select_vault_revision(user.id))).one()
+    etag = make_etag("vault-sync", user.id, revision, since, limit)
+    if if_none_match(request, etag):
+        return not_modified(etag)
+
+    rows = []
+    if since < revision:
+        statement = select_vault_changes(user.id, since, limit + 1)
+        rows = (await db.exec(statement=statement)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    page = VaultSyncModel(
+        items=[VaultItemModel.from_row(row) for row in rows],
+        cursor=rows[-1].revision if rows else since,
+        has_more=has_more,
+    )
+    return FastJSONResponse(page, headers=etag_headers(etag))
+
+
+@router.put(
+    "/items/{uid}", status_code=status.HTTP_200_OK, response_model=VaultRevisionModel
+)
+async def put_item(
+    uid: str = Path(max_length=64),
+    item: VaultItemWriteModel = Body(...),
+    user: UserResponseModel = Depends(auth_handler.get_me),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    create or replace an encrypted vault item.
+    """
+    revision = (await db.exec(statement=bump_vault_revision(user.id))).scalar_one()
+    curr_date = datetime.now()
+    statement = upsert_vault_items(
+        [
+            {
+                "user_id": user.id,
+                "uid": uid,
+                "blob": item.blob(),
+                "revision": revision,
+                "deleted": False,
+                "created_at": curr_date,
+                "updated_at": curr_date,
+            }
+        ]
+    )
+    result = (await db.exec(statement=statement)).one()
+    await db.commit()
+
+    return VaultRevisionModel(
+        uid=result.uid, revision=result.revision, updated_at=result.updated_at
+    )
+
+
+@router.delete(
+    "/items/{uid}", status_code=status.HTTP_200_OK, response_model=VaultRevisionModel
+)
+async def delete_item(
+    uid: str = Path(max_length=64),
+    user: UserResponseModel = Depends(auth_handler.get_me),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    delete a vault item, leaving a tombstone for other devices to sync.
+    """
+    revision = (await db.exec(statement=bump_vault_revision(user.id))).scalar_one()
+    statement = delete_vault_item(user.id, uid, revision, datetime.now())
+    result = (await db.exec(statement=statement)).one_or_none()
+
+    if result is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Item not found!"
+        )
+
+    await db.commit()
+    return VaultRevisionModel(
+        uid=result.uid, revision=result.revision, updated_at=result.updated_at
+    )
+
+
+async def _read_lines(request: Request, max_line: int) -> AsyncIterator[bytes]:
+    """
+    split the request body into lines as it arrives.
+    """
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > max_line:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Import line too long!",
+            )
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def _read_records(
+    request: Request, import_format: str, max_line: int
+) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    yield (line number, {"uid", "data"}) records from an ndjson or csv body.
+    csv bodies must start with a header row naming `uid` and `data`.
+    """
+    header = None
+    line_no = 0
+    async for raw in _read_lines(request, max_line):
+        line_no += 1
+        try:
+            line = raw.decode().strip()
+            if not line:
+                continue
+
+            if import_format == "csv":
+                fields = next(csv.reader([line]))
+                if header is None:
+                    header = fields
+                    continue
+                record = dict(zip(header, fields))
+            else:
+                record = json.loads(line)
+        except (ValueError, csv.Error) as error:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Invalid record on line {line_no}: {error}",
+            )
+        yield line_no, record
+
+
+async def _write_batch(
+    db: AsyncSession, user_id: int, batch: Dict[str, bytes]
+) -> int:
+    """
+    upsert one batch with a single multi-row insert, returns the last revision.
+    """
+    last = (
+        await db.exec(statement=bump_vault_revision(user_id, len(batch)))
+    ).scalar_one()
+    revision = last - len(batch)
+    curr_date = datetime.now()
+    rows = []
+    for uid, blob in batch.items():
+        revision += 1
+        rows.append(
+            {
+                "user_id": user_id,
+                "uid": uid,
+                "blob": blob,
+                "revision": revision,
+                "deleted": False,
+                "created_at": curr_date,
+                "updated_at": curr_date,
+            }
+        )
+    await db.exec(statement=upsert_vault_items(rows))
+    return last
+
+
+def _spool_record(spool: BinaryIO, uid: str, blob: bytes):
+    encoded = uid.encode()
+    spool.write(SPOOL_RECORD.pack(len(encoded), len(blob)))
+    spool.write(encoded)
+    spool.write(blob)
+
+
+def _read_spool(spool: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    spool.seek(0)
+    while header := spool.read(SPOOL_RECORD.size):
+        uid_length, blob_length = SPOOL_RECORD.unpack(header)
+        yield spool.read(uid_length).decode(), spool.read(blob_length)
+
+
+@router.post(
+    "/import", status_code=status.HTTP_200_OK, response_model=VaultImportModel
+)
+async def import_items(
+    request: Request,
+    user: UserResponseModel = Depends(auth_handler.get_me),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    bulk import items from a streamed ndjson (default) or csv body
+    (`Content-Type: text/csv`). each record has a `uid` and base64 `data`.
+
+    the body is parsed and validated as it arrives into a temporary file,
+    then written in batches in one transaction. no connection is held
+    while a slow client uploads, and the import is applied atomically.
+    """
+    content_type = request.headers.get("content-type", "")
+    import_format = "csv" if content_type.startswith("text/csv") else "ndjson"
+    # base64 grows data by a third, leave room for the uid and quoting.
+    max_line = VaultItemWriteModel.max_bytes() * 4 // 3 + 1024
+    settings = get_settings()
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES) as spool:
+        async for line_no, record in _read_records(request, import_format, max_line):
+            try:
+                uid = record["uid"]
+                if not isinstance(uid, str) or not 0 < len(uid) <= 64:
+                    raise ValueError("uid must be 1 to 64 characters")
+                blob = VaultItemWriteModel(data=record["data"]).blob()
+            except (KeyError, TypeError, ValueError, ValidationError) as error:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f"Invalid record on line {line_no}: {error}",
+                )
+            _spool_record(spool, uid, blob)
+
+        # the upload is complete, only now start the transaction.
+        await db.exec(
+            statement=text(
+                "SET LOCAL idle_in_transaction_session_timeout = "
+                f"{settings.VAULT_IMPORT_IDLE_TIMEOUT_MS}"
+            )
+        )
+        batch: Dict[str, bytes] = {}
+        imported = 0
+        for uid, blob in _read_spool(spool):
+            # a batch may only touch each uid once, the last record wins.
+            batch.pop(uid, None)
+            batch[uid] = blob
+            if len(batch) >= settings.VAULT_IMPORT_BATCH_SIZE:
+                cursor = await _write_batch(db, user.id, batch)
+                imported += len(batch)
+                batch = {}
+
+        if batch:
+            cursor = await _write_batch(db, user.id, batch)
+            imported += len(batch)
+        if not imported:
+            # nothing changed, the client's cursor stays where the vault is.
+            statement = select_vault_revision(user.id)
+            cursor = (await db.exec(statement=statement)).one()
+
+    await db.commit()
+    return VaultImportModel(imported=imported, cursor=cursor)
+
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_items(
+    export_format: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    user: UserResponseModel = Depends(auth_handler.get_me),
+):
+    """
+    stream every live item, oldest revision first, in the import format.
+    """
+    user_id = user.id
+    batch_size = get_settings().VAULT_EXPORT_BATCH_SIZE
+
+    async def rows() -> AsyncIterator[str]:
+        # dependencies are closed before a streamed body is sent, so the
+        # export reads through its own session and a server-side cursor.
+        async with async_session() as db:
+            result = await db.stream(
+                select_vault_export(user_id).execution_options(
+                    yield_per=batch_size
+                )
+            )
+            if export_format == "csv":
+                yield "uid,data,revision,updated_at\n"
+            async for partition in result.scalars().partitions():
+                out = io.StringIO()
+                writer = csv.writer(out)
+                for item in partition:
+                    data = b64encode(item.blob).decode()
+                    if export_format == "csv":
+                        writer.writerow(
+                            [item.uid, data, item.revision, item.updated_at.isoformat()]
+                        )
+                    else:
+                        out.write(
+                            json.dumps(
+                                {
+                                    "uid": item.uid,
+                                    "data": data,
+                                    "revision": item.revision,
+                                    "updated_at": item.updated_at.isoformat(),
+                                }
+                            )
+                        )
+                        out.write("\n")
+                yield out.getvalue()
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="vault.{export_format}"'
+        },
+    )
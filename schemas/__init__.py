@@ -1 +1,6 @@
 from .users import *
+from .outbox import *
+from .vault import *
+from .revocations import *
+from .signing_keys import *
+from .audit import *
@@ -0,0 +1,64 @@
+from typing import Optional
+from datetime import datetime
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    Text,
+    tuple_,
+)
+from sqlmodel import SQLModel, Field, select
+
+
+class AuditEvent(SQLModel, table=True):
+    """
+    append-only security log, range partitioned by month on `created_at`.
+
+    rows are only ever written by utils.audit in batches; a trigger rejects
+    UPDATE and DELETE, and old months are dropped a partition at a time.
+    the primary key includes `created_at` since postgres requires the
+    partition key in every unique constraint.
+    """
+
+    __tablename__ = "audit_events"
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+
+    id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(BigInteger, primary_key=True, autoincrement=True),
+    )
+    created_at: datetime = Field(
+        sa_column=Column(DateTime, primary_key=True, nullable=False)
+    )
+    event: str = Field(sa_column=Column(String(32), nullable=False))
+    user_id: Optional[int] = Field(default=None, sa_column=Column(Integer))
+    email: Optional[str] = Field(default=None, sa_column=Column(Text))
+    ip: Optional[str] = Field(default=None, sa_column=Column(String(64)))
+    user_agent: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+
+# a user's activity, newest first, for keyset pages in every partition.
+Index(
+    "ix_audit_events_user_created",
+    AuditEvent.user_id,
+    AuditEvent.created_at.desc(),
+    AuditEvent.id.desc(),
+)
+
+
+def select_user_activity(user_id: int, before: tuple[datetime, int] | None, limit: int):
+    """
+    keyset page over ix_audit_events_user_created, `before` is the
+    (created_at, id) of the last event of the previous page.
+    """
+    statement = select(AuditEvent).where(AuditEvent.user_id == user_id)
+    if before is not None:
+        statement = statement.where(
+            tuple_(AuditEvent.created_at, AuditEvent.id) < tuple_(*before)
+        )
+    return statement.order_by(
+        AuditEvent.created_at.desc(), AuditEvent.id.desc()
+    ).limit(limit)
@@ -0,0 +1,56 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from sqlalchemy import Column, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import SQLModel, Field
+from models.emails import EmailModel
+
+
+class OutboxStatus:
+    PENDING = "pending"
+    PROCESSING = "processing"
+    FAILED = "failed"
+
+
+class EmailOutbox(SQLModel, table=True):
+    __tablename__ = "email_outbox"
+
+    id: Optional[int] = Field(primary_key=True, default=None)
+    email_to: List[str] = Field(sa_column=Column(JSONB, nullable=False))
+    subject: str = Field(...)
+    template_name: str = Field(...)
+    template_body: Dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    status: str = Field(default=OutboxStatus.PENDING)
+    attempts: int = Field(default=0)
+    available_at: datetime = Field(...)
+    claimed_at: Optional[datetime] = Field(default=None)
+    last_error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(...)
+
+    @classmethod
+    def from_email(cls, email_data: EmailModel) -> "EmailOutbox":
+        curr_date = datetime.now()
+        return cls(
+            email_to=list(email_data.email_to),
+            subject=email_data.subject,
+            template_name=email_data.template_name,
+            template_body=email_data.template_body,
+            available_at=curr_date,
+            created_at=curr_date,
+        )
+
+    def to_email(self) -> EmailModel:
+        return EmailModel(
+            email_to=self.email_to,
+            subject=self.subject,
+            template_name=self.template_name,
+            template_body=self.template_body,
+        )
+
+
+Index(
+    "ix_email_outbox_due",
+    EmailOutbox.status,
+    EmailOutbox.available_at,
+    postgresql_where=EmailOutbox.status != OutboxStatus.FAILED,
+)
@@ -0,0 +1,25 @@
+from typing import Optional
+from datetime import datetime
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class TokenRevocation(SQLModel, table=True):
+    """
+    either one token (`jti`) or every token of `subject` issued at or before
+    `issued_before` (unix time). rows are useless once `expires_at` has
+    passed since the tokens they cover have expired by then.
+    """
+
+    __tablename__ = "token_revocations"
+
+    id: Optional[int] = Field(primary_key=True, default=None)
+    jti: Optional[str] = Field(default=None, max_length=64)
+    subject: Optional[str] = Field(default=None)
+    issued_before: Optional[float] = Field(default=None)
+    expires_at: datetime = Field(...)
+    created_at: datetime = Field(...)
+
+
+Index("ix_token_revocations_created_at", TokenRevocation.created_at)
+Index("ix_token_revocations_expires_at", TokenRevocation.expires_at)
@@ -0,0 +1,25 @@
+from typing import Any, Dict, Optional
+from datetime import datetime
+from sqlalchemy import JSON, Column, Index, Text
+from sqlmodel import SQLModel, Field
+
+
+class SigningKey(SQLModel, table=True):
+    """
+    one access token signing key. it is published in the JWKS from creation,
+    signs tokens from `activates_at` until a newer key activates, and keeps
+    verifying until `retires_at`, after its last tokens have expired.
+    """
+
+    __tablename__ = "signing_keys"
+
+    kid: str = Field(primary_key=True, max_length=64)
+    algorithm: str = Field(max_length=16)
+    private_key: str = Field(sa_column=Column(Text, nullable=False))
+    public_jwk: Dict[str, Any] = Field(sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(...)
+    activates_at: datetime = Field(...)
+    retires_at: Optional[datetime] = Field(default=None)
+
+
+Index("ix_signing_keys_retires_at", SigningKey.retires_at)
@@ -1,7 +1,16 @@
 from typing import Optional
 from pydantic import EmailStr
 from datetime import datetime
-from sqlmodel import SQLModel, Field
+from sqlalchemy import BigInteger, Column, Index, func, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import SQLModel, Field, select
+
+
+def normalize_email(email: str) -> str:
+    """
+    canonical form used for storing and looking up emails.
+    """
+    return email.strip().lower()
 
 
 class Users(SQLModel, table=True):
@@ -13,3 +22,79 @@ class Users(SQLModel, table=True):
     created_at: datetime = Field(...)
     updated_at: datetime = Field(...)
     is_verified: bool = Field(default=False)
+    vault_revision: int = Field(
+        default=0,
+        sa_column=Column(BigInteger, nullable=False, server_default=text("0")),
+    )
+
+
+Index("ix_users_email_lower", func.lower(Users.email), unique=True)
+
+
+def email_matches(email: str):
+    """
+    where clause for an email lookup that can use ix_users_email_lower.
+    """
+    return func.lower(Users.email) == normalize_email(email)
+
+
+def select_user_by_email(email: str):
+    return select(Users).where(email_matches(email))
+
+
+def insert_user_if_absent(name: str, email: str, password: str, curr_date: datetime):
+    """
+    single statement register, returns the new id or no row when the
+    email is already taken.
+    """
+    return (
+        insert(Users)
+        .values(
+            name=name,
+            email=normalize_email(email),
+            password=password,
+            avatar="",
+            is_verified=False,
+            created_at=curr_date,
+            updated_at=curr_date,
+        )
+        .on_conflict_do_nothing(index_elements=[func.lower(Users.email)])
+        .returning(Users.id)
+    )
+
+
+def verify_user_by_email(email: str, curr_date: datetime):
+    """
+    marks an unverified user verified, returns no row when the user is
+    missing or already verified.
+    """
+    return (
+        update(Users)
+        .where(email_matches(email), Users.is_verified.is_(False))
+        .values(is_verified=True, updated_at=curr_date)
+        .returning(Users.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def set_user_password(email: str, password: str, curr_date: datetime):
+    return (
+        update(Users)
+        .where(email_matches(email))
+        .values(password=password, updated_at=curr_date)
+        .returning(Users.id, Users.email)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rehash_user_password(user_id: int, old_password: str, new_password: str):
+    """
+    swap in an upgraded hash of the same password. matching on the old
+    hash leaves a password changed in the meantime untouched.
+    """
+    return (
+        update(Users)
+        .where(Users.id == user_id, Users.password == old_password)
+        .values(password=new_password)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, Index, LargeBinary, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import SQLModel, Field, select
+from .users import Users
+
+
+class VaultItem(SQLModel, table=True):
+    __tablename__ = "vault_items"
+
+    id: Optional[int] = Field(primary_key=True, default=None)
+    user_id: int = Field(foreign_key="users.id", nullable=False)
+    uid: str = Field(max_length=64)
+    blob: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    revision: int = Field(sa_column=Column(BigInteger, nullable=False))
+    deleted: bool = Field(default=False)
+    created_at: datetime = Field(...)
+    updated_at: datetime = Field(...)
+
+
+Index("ux_vault_items_user_uid", VaultItem.user_id, VaultItem.uid, unique=True)
+Index(
+    "ux_vault_items_user_revision",
+    VaultItem.user_id,
+    VaultItem.revision,
+    unique=True,
+)
+
+
+def bump_vault_revision(user_id: int, count: int = 1):
+    """
+    reserve `count` revisions for a user, returns the highest one.
+
+    the row lock on the user serializes that user's vault writes until
+    commit, so revisions become visible in order and a sync cursor never
+    skips a concurrently committed item.
+    """
+    return (
+        update(Users)
+        .where(Users.id == user_id)
+        .values(vault_revision=Users.vault_revision + count)
+        .returning(Users.vault_revision)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def upsert_vault_items(rows: List[Dict[str, Any]]):
+    """
+    multi-row insert that overwrites existing items with the same uid.
+    """
+    statement = insert(VaultItem).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[VaultItem.user_id, VaultItem.uid],
+        set_={
+            "blob": statement.excluded.blob,
+            "revision": statement.excluded.revision,
+            "deleted": statement.excluded.deleted,
+            "updated_at": statement.excluded.updated_at,
+        },
+    ).returning(VaultItem.uid, VaultItem.revision, VaultItem.updated_at)
+
+
+def delete_vault_item(user_id: int, uid: str, revision: int, curr_date: datetime):
+    """
+    turn an item into a tombstone so syncing clients learn about the delete.
+    """
+    return (
+        update(VaultItem)
+        .where(
+            VaultItem.user_id == user_id,
+            VaultItem.uid == uid,
+            VaultItem.deleted.is_(False),
+        )
+        .values(blob=b"", deleted=True, revision=revision, updated_at=curr_date)
+        .returning(VaultItem.uid, VaultItem.revision, VaultItem.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def select_vault_revision(user_id: int):
+    """
+    the user's latest vault revision, a version stamp for the whole vault.
+    """
+    return select(Users.vault_revision).where(Users.id == user_id)
+
+
+def select_vault_changes(user_id: int, since: int, limit: int):
+    """
+    keyset page over ux_vault_items_user_revision.
+    """
+    return (
+        select(VaultItem)
+        .where(VaultItem.user_id == user_id, VaultItem.revision > since)
+        .order_by(VaultItem.revision)
+        .limit(limit)
+    )
+
+
+def select_vault_export(user_id: int):
+    return (
+        select(VaultItem)
+        .where(VaultItem.user_id == user_id, VaultItem.deleted.is_(False))
+        .order_by(VaultItem.revision)
+    )
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from models.audit import AuditEventType
+from utils.audit import AuditLog
+from utils.metrics import audit_dropped
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def make_audit_log(copy_seconds: float) -> AuditLog:
+    audit = AuditLog(
+        enabled=True,
+        batch_size=2,
+        max_queue=4,
+        flush_interval=60,
+        block_timeout=0.3,
+        retention_months=0,
+    )
+    audit.written = []
+
+    async def copy(batch):
+        await asyncio.sleep(copy_seconds)
+        audit.written.extend(batch)
+
+    audit._copy = copy
+    return audit
+
+
+def dropped() -> float:
+    return audit_dropped._values.get((), 0.0)
+
+
+async def test_full_queue_waits_for_a_flush():
+    audit = make_audit_log(copy_seconds=0.01)
+    audit._task = asyncio.create_task(audit._run())
+    before = dropped()
+    try:
+        await asyncio.gather(
+            *(audit.record(AuditEventType.LOGIN_FAILED) for _ in range(20))
+        )
+        await audit.record(AuditEventType.PASSWORD_RESET)
+    finally:
+        await audit.stop()
+
+    assert dropped() == before
+    assert len(audit.written) == 21
+    assert audit.written[-1].event == AuditEventType.PASSWORD_RESET.value
+
+
+async def test_full_queue_drops_after_block_timeout():
+    # no flusher, as if the database were down.
+    audit = make_audit_log(copy_seconds=60)
+    before = dropped()
+    for _ in range(4):
+        await audit.record(AuditEventType.LOGIN_FAILED)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await audit.record(AuditEventType.LOGIN_FAILED)
+    elapsed = loop.time() - started
+
+    assert 0.3 <= elapsed < 1
+    assert len(audit) == 4
+    assert dropped() == before + 1
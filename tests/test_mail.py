@@ -0,0 +1,223 @@
+import asyncio
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+from fastapi_mail import ConnectionConfig
+from models.emails import EmailModel, EmailTypes
+from utils.mail import MailDispatcher, MailDispatcherStopped, _Delivery
+from utils.templates import TEMPLATE_FOLDER, mail_templates
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingHandler:
+    """
+    aiosmtpd handler keeping every message and the session it came on.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def port():
+    return free_port()
+
+
+@pytest.fixture
+def handler():
+    return RecordingHandler()
+
+
+@pytest.fixture
+def smtp_server(handler, port):
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+def make_dispatcher(port: int, **overrides) -> MailDispatcher:
+    mail_templates.load()
+    config = ConnectionConfig(
+        MAIL_USERNAME="",
+        MAIL_PASSWORD="",
+        MAIL_FROM="onepass@example.com",
+        MAIL_FROM_NAME="onePass",
+        MAIL_PORT=port,
+        MAIL_SERVER="127.0.0.1",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=False,
+        TEMPLATE_FOLDER=TEMPLATE_FOLDER,
+        TIMEOUT=5,
+    )
+    options = {
+        "connections": 1,
+        "batch_size": 10,
+        "max_queue": 100,
+        "max_retries": 3,
+        "retry_backoff": 0.01,
+    }
+    options.update(overrides)
+    return MailDispatcher(config, mail_templates, **options)
+
+
+def registration(to: str) -> EmailModel:
+    return EmailModel(
+        subject=EmailTypes.REGISTRATION.subject,
+        email_to=[to],
+        template_body={"name": "Test", "link": "https://example.com/verify"},
+        template_name=EmailTypes.REGISTRATION.template,
+    )
+
+
+async def send_all(dispatcher: MailDispatcher, count: int, offset: int = 0):
+    futures = [
+        await dispatcher.enqueue(registration(f"user{offset + i}@example.com"))
+        for i in range(count)
+    ]
+    await asyncio.wait_for(asyncio.gather(*futures), timeout=10)
+
+
+async def test_sends_batches_over_one_connection(smtp_server, handler, port):
+    dispatcher = make_dispatcher(port)
+    await dispatcher.start()
+    try:
+        await send_all(dispatcher, 25)
+        stats = dispatcher.stats()
+    finally:
+        await dispatcher.stop()
+
+    assert len(handler.messages) == 25
+    assert handler.messages[0].rcpt_tos == ["user0@example.com"]
+    assert len(handler.sessions) == 1
+    assert stats["queue_depth"] == 0
+    assert stats["sent"] == 25
+    assert stats["failed"] == 0
+    assert stats["retried"] == 0
+    assert stats["batches"] >= 3
+    assert stats["open_connections"] == 1
+    assert dispatcher.stats()["open_connections"] == 0
+
+
+async def test_renders_batch_once_per_template(monkeypatch, port):
+    dispatcher = make_dispatcher(port)
+    calls = []
+    render_batch = mail_templates.render_batch
+
+    def counting_render_batch(name, contexts):
+        calls.append((name, len(contexts)))
+        return render_batch(name, contexts)
+
+    monkeypatch.setattr(mail_templates, "render_batch", counting_render_batch)
+    reset = EmailModel(
+        subject=EmailTypes.PASSWORD_RESET.subject,
+        email_to=["reset@example.com"],
+        template_body={"name": "Test", "link": "https://example.com/reset"},
+        template_name=EmailTypes.PASSWORD_RESET.template,
+    )
+    batch = [
+        _Delivery(registration("user0@example.com"), None),
+        _Delivery(reset, None),
+        _Delivery(registration("user1@example.com"), None),
+    ]
+    messages = dispatcher._render_batch(batch)
+
+    assert calls == [
+        (EmailTypes.REGISTRATION.template, 2),
+        (EmailTypes.PASSWORD_RESET.template, 1),
+    ]
+    assert [message["To"] for message in messages] == [
+        "user0@example.com",
+        "reset@example.com",
+        "user1@example.com",
+    ]
+    assert "Copyright" in messages[0].get_content()
+
+
+async def test_reconnects_after_server_drops(handler, port):
+    dispatcher = make_dispatcher(port)
+    first = Controller(handler, hostname="127.0.0.1", port=port)
+    first.start()
+    await dispatcher.start()
+    try:
+        await send_all(dispatcher, 1)
+
+        # the worker's open connection dies with the server.
+        first.stop()
+        second = Controller(handler, hostname="127.0.0.1", port=port)
+        second.start()
+        try:
+            await send_all(dispatcher, 3, offset=1)
+            stats = dispatcher.stats()
+        finally:
+            second.stop()
+    finally:
+        await dispatcher.stop()
+
+    assert len(handler.messages) == 4
+    assert len(handler.sessions) == 2
+    assert stats["queue_depth"] == 0
+    assert stats["sent"] == 4
+    assert stats["failed"] == 0
+    assert stats["retried"] <= 1
+
+
+async def test_retries_with_backoff_then_fails(port):
+    # nothing listens on `port`, every connect is refused.
+    dispatcher = make_dispatcher(port, max_retries=2, retry_backoff=0.05)
+    await dispatcher.start()
+    try:
+        future = await dispatcher.enqueue(registration("down@example.com"))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with pytest.raises(OSError):
+            await asyncio.wait_for(future, timeout=10)
+        elapsed = loop.time() - started
+        stats = dispatcher.stats()
+    finally:
+        await dispatcher.stop()
+
+    # two retries, 0.05s then 0.1s apart.
+    assert elapsed >= 0.15
+    assert stats["queue_depth"] == 0
+    assert stats["retrying"] == 0
+    assert stats["sent"] == 0
+    assert stats["retried"] == 2
+    assert stats["failed"] == 1
+
+
+async def test_stop_fails_deliveries_waiting_to_retry(port):
+    # nothing listens on `port`, the first attempt fails and waits 60s.
+    dispatcher = make_dispatcher(port, retry_backoff=60)
+    await dispatcher.start()
+    future = await dispatcher.enqueue(registration("later@example.com"))
+    while not dispatcher.stats()["retrying"]:
+        await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(dispatcher.stop(timeout=1), timeout=5)
+
+    with pytest.raises(MailDispatcherStopped):
+        future.result()
+    assert dispatcher.stats()["retrying"] == 0
+    stopped = await dispatcher.enqueue(registration("after@example.com"))
+    with pytest.raises(MailDispatcherStopped):
+        stopped.result()
@@ -0,0 +1,58 @@
+import ipaddress
+from types import SimpleNamespace
+import pytest
+from starlette.requests import Request
+from utils import ratelimit
+from utils.ratelimit import client_ip
+
+
+def make_request(peer: str | None, *forwarded: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "client": (peer, 50000) if peer else None,
+            "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded],
+        }
+    )
+
+
+@pytest.fixture
+def trust(monkeypatch):
+    def trust(*networks: str):
+        settings = SimpleNamespace(
+            TRUSTED_PROXIES=[ipaddress.ip_network(network) for network in networks]
+        )
+        monkeypatch.setattr(ratelimit, "get_settings", lambda: settings)
+
+    return trust
+
+
+def test_ignores_forwarded_for_without_trusted_proxies(trust):
+    trust()
+
+    assert client_ip(make_request("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+    assert client_ip(make_request(None)) is None
+
+
+def test_ignores_forwarded_for_from_untrusted_peer(trust):
+    trust("10.0.0.0/8")
+
+    assert client_ip(make_request("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+
+
+def test_takes_right_most_untrusted_hop(trust):
+    trust("10.0.0.0/8")
+
+    # the client forged the first entry, the proxies appended the rest.
+    request = make_request("10.1.2.3", "192.0.2.66, 198.51.100.1, 10.4.5.6")
+    assert client_ip(request) == "198.51.100.1"
+    request = make_request("10.1.2.3", "192.0.2.66", "198.51.100.1")
+    assert client_ip(request) == "198.51.100.1"
+
+
+def test_stops_at_malformed_or_missing_hops(trust):
+    trust("10.0.0.0/8")
+
+    assert client_ip(make_request("10.1.2.3", "not-an-ip, 10.4.5.6")) == "10.4.5.6"
+    assert client_ip(make_request("10.1.2.3", "10.4.5.6")) == "10.4.5.6"
+    assert client_ip(make_request("10.1.2.3")) == "10.1.2.3"
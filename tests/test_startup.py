@@ -0,0 +1,67 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+IMPORT_BUDGET_SECONDS = 2.0
+
+# records network and template i/o while importing the app, then reports
+# the import time and whether the engine or templates were set up.
+IMPORT_PROBE = """
+import json, os, sys, time
+
+events = []
+template_folder = os.path.join(os.getcwd(), "templates")
+
+def audit(event, args):
+    if event == "socket.connect":
+        events.append([event, repr(args[1])])
+    elif event == "socket.getaddrinfo":
+        events.append([event, repr(args[0])])
+    elif event == "open" and str(args[0]).startswith(template_folder):
+        events.append([event, args[0]])
+
+sys.addaudithook(audit)
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+
+from utils import db
+from utils.templates import mail_templates
+
+print(json.dumps({
+    "seconds": elapsed,
+    "events": events,
+    "engine": db._engine is not None,
+    "templates": bool(mail_templates._compiled),
+}))
+"""
+
+
+def probe_import() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=ROOT,
+        env={},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_import_needs_no_configuration_or_io():
+    report = probe_import()
+
+    assert report["events"] == []
+    assert not report["engine"]
+    assert not report["templates"]
+
+
+def test_import_within_budget():
+    # best of three, a cold disk cache should not fail the build.
+    seconds = min(probe_import()["seconds"] for _ in range(3))
+
+    assert seconds < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,3 @@
+"""
+offline maintenance tools, run with `python -m tools.<name>`.
+"""
@@ -0,0 +1,168 @@
+"""
+build the breached password index read by utils.breach.
+
+    python -m tools.build_breach_index pwned-passwords-sha1.txt breach.idx
+
+inputs are text files with a 40 character hex SHA-1 at the start of each
+line, e.g. the Pwned Passwords `HASH:COUNT` downloads; `--plaintext` hashes
+each line instead. inputs are sorted in chunks of `--chunk-size` hashes
+spilled to temporary files and merged, so memory stays bounded whatever
+the dataset size. point BREACHED_PASSWORDS_PATH at the output.
+"""
+import argparse
+import hashlib
+import heapq
+import os
+import sys
+import tempfile
+import time
+from typing import BinaryIO, Iterable, Iterator, List
+from utils.breach import (
+    HEADER,
+    MAGIC,
+    PREFIXES,
+    RECORD_SIZE,
+    RECORDS_OFFSET,
+    TABLE_ENTRY,
+    TABLE_OFFSET,
+    VERSION,
+)
+
+
+def read_digests(
+    paths: Iterable[str], plaintext: bool = False, min_count: int = 0
+) -> Iterator[bytes]:
+    """
+    Yields:
+        bytes: one 20 byte digest per usable input line
+    """
+    for path in paths:
+        # bytes throughout: dumps are not all UTF-8, and a password's raw
+        # bytes are what was hashed for it.
+        with open(path, "rb") as file:
+            for number, line in enumerate(file, 1):
+                line = line.rstrip(b"\r\n")
+                if plaintext:
+                    if line:
+                        yield hashlib.sha1(line).digest()
+                    continue
+
+                line = line.strip()
+                if not line or line.startswith(b"#"):
+                    continue
+                digest, _, count = line.partition(b":")
+                try:
+                    if len(digest) != RECORD_SIZE * 2:
+                        raise ValueError
+                    if min_count and count and int(count) < min_count:
+                        continue
+                    yield bytes.fromhex(digest.decode("ascii"))
+                except ValueError:
+                    raise SystemExit(f"{path}:{number}: not a HASH[:COUNT] line")
+
+
+def _write_run(digests: List[bytes], directory: str) -> str:
+    digests.sort()
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as run:
+        run.write(b"".join(digests))
+    return run.name
+
+
+def _read_run(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as run:
+        while record := run.read(RECORD_SIZE):
+            yield record
+
+
+def sorted_runs(digests: Iterable[bytes], chunk_size: int, directory: str) -> List[str]:
+    runs, chunk = [], []
+    for digest in digests:
+        chunk.append(digest)
+        if len(chunk) >= chunk_size:
+            runs.append(_write_run(chunk, directory))
+            chunk = []
+    if chunk:
+        runs.append(_write_run(chunk, directory))
+    return runs
+
+
+def write_index(output: BinaryIO, digests: Iterable[bytes]) -> int:
+    """
+    write sorted `digests` as an index, dropping duplicates.
+
+    Returns:
+        int: number of records written
+    """
+    table = [0] * (PREFIXES + 1)
+    output.seek(RECORDS_OFFSET)
+    count, previous = 0, None
+    for digest in digests:
+        if digest == previous:
+            continue
+        output.write(digest)
+        table[int.from_bytes(digest[:2], "big") + 1] += 1
+        count, previous = count + 1, digest
+
+    # bucket sizes to the index of each bucket's first record.
+    for prefix in range(PREFIXES):
+        table[prefix + 1] += table[prefix]
+    output.seek(0)
+    output.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, count))
+    output.seek(TABLE_OFFSET)
+    output.write(b"".join(TABLE_ENTRY.pack(entry) for entry in table))
+    return count
+
+
+def build(
+    inputs: List[str],
+    output: str,
+    plaintext: bool = False,
+    min_count: int = 0,
+    chunk_size: int = 2_000_000,
+) -> int:
+    directory = os.path.dirname(os.path.abspath(output))
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        runs = sorted_runs(
+            read_digests(inputs, plaintext, min_count), chunk_size, scratch
+        )
+        partial = os.path.join(scratch, "index")
+        with open(partial, "wb") as file:
+            count = write_index(file, heapq.merge(*map(_read_run, runs)))
+            file.flush()
+            os.fsync(file.fileno())
+        # servers only ever see a complete index.
+        os.replace(partial, output)
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tools.build_breach_index")
+    parser.add_argument("inputs", nargs="+", help="hash or password lists")
+    parser.add_argument("output", help="index file to write")
+    parser.add_argument(
+        "--plaintext", action="store_true", help="inputs list passwords, not hashes"
+    )
+    parser.add_argument(
+        "--min-count",
+        type=int,
+        default=0,
+        help="skip HASH:COUNT lines seen fewer times than this",
+    )
+    parser.add_argument("--chunk-size", type=int, default=2_000_000)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    count = build(
+        args.inputs,
+        args.output,
+        plaintext=args.plaintext,
+        min_count=args.min_count,
+        chunk_size=args.chunk_size,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {count} hashes to {args.output} in {elapsed:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
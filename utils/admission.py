@@ -0,0 +1,187 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict
+from config.env import get_settings
+from utils.metrics import (
+    admission_in_flight,
+    admission_queued,
+    admission_shed,
+    admission_wait,
+)
+from utils.responses import FastJSONResponse
+
+HEAVY = "heavy"
+LIGHT = "light"
+TRANSFER = "transfer"
+
+# password hashing and outgoing mail. anything not listed, like /auth/me,
+# /auth/refresh and vault sync, is light.
+HEAVY_ROUTES = (
+    "/auth/login",
+    "/auth/register",
+    "/auth/reset_pwd/",
+    "/auth/forgot_pwd",
+    "/auth/resend_verify",
+)
+# bulk vault transfers hold their slot for as long as the client takes to
+# send or receive the body, so slow clients only exhaust their own class.
+TRANSFER_ROUTES = (
+    "/vault/import",
+    "/vault/export",
+)
+# never queued or shed, so monitoring still works under overload.
+EXEMPT_ROUTES = ("/metrics",)
+
+
+def route_class(path: str) -> str | None:
+    """
+    Returns:
+        str | None: HEAVY, TRANSFER or LIGHT, None for exempt paths
+    """
+    if path.startswith(EXEMPT_ROUTES):
+        return None
+    if path.startswith(HEAVY_ROUTES):
+        return HEAVY
+    if path.startswith(TRANSFER_ROUTES):
+        return TRANSFER
+    return LIGHT
+
+
+class ConcurrencyLimiter:
+    """
+    at most `limit` requests in flight, up to `max_queue` more wait in FIFO
+    order for `queue_timeout` seconds. `acquire` returns why it gave up
+    instead of queueing without bound.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(False)
+            self._waiters.remove(waiter)
+            admission_queued.set(self.name, value=len(self._waiters))
+
+    async def acquire(self) -> str | None:
+        """
+        Returns:
+            str | None: None once a slot is held, otherwise "queue_full" or
+            "timeout" and nothing to release.
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            admission_in_flight.set(self.name, value=self.in_flight)
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        admission_queued.set(self.name, value=len(self._waiters))
+        timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        started = time.perf_counter()
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            # the client went away, pass on a slot handed over meanwhile.
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+            admission_wait.observe(time.perf_counter() - started, self.name)
+        return None if granted else "timeout"
+
+    def release(self):
+        # hand the slot straight to the oldest waiter, if any.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                admission_queued.set(self.name, value=len(self._waiters))
+                return
+        self.in_flight -= 1
+        admission_in_flight.set(self.name, value=self.in_flight)
+
+
+def build_limiters() -> Dict[str, ConcurrencyLimiter]:
+    settings = get_settings()
+    return {
+        HEAVY: ConcurrencyLimiter(
+            HEAVY,
+            limit=settings.ADMISSION_HEAVY_CONCURRENCY,
+            max_queue=settings.ADMISSION_HEAVY_QUEUE,
+            queue_timeout=settings.ADMISSION_HEAVY_TIMEOUT_SECONDS,
+        ),
+        TRANSFER: ConcurrencyLimiter(
+            TRANSFER,
+            limit=settings.ADMISSION_TRANSFER_CONCURRENCY,
+            max_queue=settings.ADMISSION_TRANSFER_QUEUE,
+            queue_timeout=settings.ADMISSION_TRANSFER_TIMEOUT_SECONDS,
+        ),
+        LIGHT: ConcurrencyLimiter(
+            LIGHT,
+            limit=settings.ADMISSION_LIGHT_CONCURRENCY,
+            max_queue=settings.ADMISSION_LIGHT_QUEUE,
+            queue_timeout=settings.ADMISSION_LIGHT_TIMEOUT_SECONDS,
+        ),
+    }
+
+
+class AdmissionMiddleware:
+    """
+    pure ASGI middleware capping in-flight requests per route class.
+
+    heavy, transfer and light routes have separate budgets, so a burst of
+    logins or slow vault exports cannot starve /auth/me, /auth/refresh or
+    each other.
+    requests that cannot get a slot in time get a 503 with Retry-After
+    rather than adding to an unbounded backlog. does nothing when
+    ADMISSION_CONTROL_ENABLED is false.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+        self.enabled: bool | None = None
+        self.limiters: Dict[str, ConcurrencyLimiter] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.enabled is None:
+            self.enabled = get_settings().ADMISSION_CONTROL_ENABLED
+            self.limiters = build_limiters()
+        name = route_class(scope["path"]) if self.enabled else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[name]
+        reason = await limiter.acquire()
+        if reason is not None:
+            admission_shed.inc(name, reason)
+            response = FastJSONResponse(
+                {"detail": "Server is busy, please try again shortly."},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -0,0 +1,270 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Deque, List, NamedTuple, Set, Tuple
+from fastapi import HTTPException, Request, status
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from config.env import get_settings
+from models.audit import AuditEventType
+from utils.db import get_engine
+from utils.locks import PARTITION_LOCK_ID
+from utils.metrics import (
+    audit_dropped,
+    audit_flush_duration,
+    audit_flushed,
+    audit_queued,
+)
+from utils.ratelimit import client_ip
+
+COLUMNS = ("created_at", "event", "user_id", "email", "ip", "user_agent")
+USER_AGENT_MAX_LENGTH = 256
+
+PARTITIONS_QUERY = text(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = 'audit_events'::regclass"
+)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class AuditRecord(NamedTuple):
+    created_at: datetime
+    event: str
+    user_id: int | None
+    email: str | None
+    ip: str | None
+    user_agent: str | None
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return datetime(year, index + 1, 1)
+
+
+def month_start(date: datetime) -> datetime:
+    return datetime(date.year, date.month, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"audit_events_{month:%Y_%m}"
+
+
+def encode_cursor(created_at: datetime, event_id: int) -> str:
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}-{event_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Raises:
+        HTTPException: 422 for a cursor not made by `encode_cursor`.
+    """
+    try:
+        micros, event_id = cursor.split("-")
+        return EPOCH + timedelta(microseconds=int(micros)), int(event_id)
+    except (ValueError, OverflowError):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor!"
+        )
+
+
+class AuditLog:
+    """
+    bounded in-memory queue in front of the audit_events table.
+
+    `record` only appends to the queue. a background task COPYs it to the
+    table in batches of `batch_size`, every `flush_interval` seconds or as
+    soon as a batch is full, creating monthly partitions as needed and
+    dropping the ones older than `retention_months`.
+
+    once `max_queue` events are waiting, `record` starts a flush and waits
+    up to `block_timeout` for room before dropping the event, so a burst
+    of events slows the calls producing it instead of crowding out the
+    events after it, and memory stays bounded. `stop` flushes what is left.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        batch_size: int,
+        max_queue: int,
+        flush_interval: float,
+        block_timeout: float,
+        retention_months: int,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.retention_months = retention_months
+
+        self._queue: Deque[AuditRecord] = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._partitions: Set[datetime] = set()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def record(
+        self,
+        event: AuditEventType,
+        request: Request | None = None,
+        email: str | None = None,
+        user_id: int | None = None,
+    ):
+        """
+        queue one event, stamped now.
+
+        Args:
+            event (AuditEventType): what happened
+            request (Request | None): source of the client ip and user agent
+            email (str | None): normalized email the event is about
+            user_id (int | None): user the event is about, if known
+        """
+        if not self.enabled:
+            return
+
+        if len(self._queue) >= self.max_queue:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.block_timeout
+            # other waiters may take the room a batch freed, wait again.
+            while len(self._queue) >= self.max_queue:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    audit_dropped.inc()
+                    return
+                self._drained.clear()
+                # flush now rather than at the next interval.
+                self._wakeup.set()
+                try:
+                    await asyncio.wait_for(self._drained.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        ip = user_agent = None
+        if request is not None:
+            ip = client_ip(request)
+            user_agent = request.headers.get("user-agent")
+            if user_agent is not None:
+                user_agent = user_agent[:USER_AGENT_MAX_LENGTH]
+
+        self._queue.append(
+            AuditRecord(datetime.now(), event.value, user_id, email, ip, user_agent)
+        )
+        audit_queued.set(value=len(self._queue))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _drop_expired(self, conn: AsyncConnection):
+        cutoff = add_months(month_start(datetime.now()), -self.retention_months)
+        for (name,) in (await conn.execute(PARTITIONS_QUERY)).all():
+            try:
+                month = datetime.strptime(name[-7:], "%Y_%m")
+            except ValueError:
+                continue
+            if month < cutoff:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                print(f"Dropped audit partition {name}.")
+
+    async def ensure_partitions(self, months: Set[datetime]):
+        """
+        create the partitions for `months` and the month after each, so
+        the DDL is off the flush path when a month starts.
+        """
+        missing = months - self._partitions
+        if not missing:
+            return
+
+        wanted = missing | {add_months(month, 1) for month in missing}
+        async with get_engine().begin() as conn:
+            await conn.execute(select(func.pg_advisory_xact_lock(PARTITION_LOCK_ID)))
+            for month in sorted(wanted):
+                await conn.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+                        "PARTITION OF audit_events FOR VALUES "
+                        f"FROM ('{month:%Y-%m-%d}') "
+                        f"TO ('{add_months(month, 1):%Y-%m-%d}')"
+                    )
+                )
+            if self.retention_months:
+                await self._drop_expired(conn)
+        self._partitions |= wanted
+
+    async def _copy(self, batch: List[AuditRecord]):
+        await self.ensure_partitions({month_start(row.created_at) for row in batch})
+        async with get_engine().connect() as conn:
+            raw = await conn.get_raw_connection()
+            # COPY routes each row to its partition, one round trip per batch.
+            await raw.driver_connection.copy_records_to_table(
+                "audit_events", records=batch, columns=COLUMNS
+            )
+
+    async def flush(self):
+        """
+        write queued events in batches until the queue is empty. a failed
+        batch goes back to the front of the queue.
+        """
+        while self._queue:
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            started = time.perf_counter()
+            try:
+                await self._copy(batch)
+            except BaseException:
+                self._queue.extendleft(reversed(batch))
+                raise
+            finally:
+                audit_queued.set(value=len(self._queue))
+            audit_flush_duration.observe(time.perf_counter() - started)
+            audit_flushed.inc(amount=len(batch))
+            self._drained.set()
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self.ensure_partitions({month_start(datetime.now())})
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="audit-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._queue:
+            try:
+                await self.flush()
+            except Exception as error:
+                print(f"Audit flush failed, {len(self._queue)} events lost: {error}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as error:
+                print(f"Audit flush failed: {error}")
+                await asyncio.sleep(self.flush_interval)
+
+
+@lru_cache
+def get_audit_log() -> AuditLog:
+    settings = get_settings()
+    return AuditLog(
+        enabled=settings.AUDIT_ENABLED,
+        batch_size=settings.AUDIT_BATCH_SIZE,
+        max_queue=settings.AUDIT_MAX_QUEUE,
+        flush_interval=settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+        block_timeout=settings.AUDIT_BLOCK_SECONDS,
+        retention_months=settings.AUDIT_RETENTION_MONTHS,
+    )
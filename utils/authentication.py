@@ -1,81 +1,176 @@
-from os import environ
-from dotenv import load_dotenv
-from typing import Dict
-from datetime import datetime, timedelta
+from functools import cached_property, lru_cache, partial
+from hashlib import blake2b
+from typing import Any, Dict, NamedTuple, Tuple
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 from fastapi import Depends, status
-from passlib.context import CryptContext
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt, JWTError
-from sqlmodel import Session, select
-from config.env import OnepassEnvs
-from utils.db import get_db
+from sqlmodel.ext.asyncio.session import AsyncSession
+from config.env import get_settings
+from utils.cache import TTLCache
+from utils.db import get_read_db, read_one
+from utils.hashing import get_password_hasher, pwd_ctx
+from utils.keyring import ALGORITHM as KEY_RING_ALGORITHM, get_key_ring
+from utils.metrics import (
+    collect_cache,
+    jwt_duration,
+    password_hash_duration,
+    registry,
+)
+from utils.revocation import get_revocations
 from models.auth import TokenTypeModel, UserResponseModel
-from schemas import Users
+from schemas import normalize_email, select_user_by_email
 
-load_dotenv()
 
+@lru_cache
+def get_user_cache() -> TTLCache:
+    """
+    UserResponseModel per normalized email, serves /auth/me without a query.
+    """
+    settings = get_settings()
+    cache = TTLCache(
+        maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS
+    )
+    registry.collector("user_cache", partial(collect_cache, "user", cache))
+    return cache
 
-class Authentication:
-    ACCESS_TOKEN_SECRET_KEY = OnepassEnvs.get("ACCESS_TOKEN_SECRET_KEY")
-    REFRESH_TOKEN_SECRET_KEY = OnepassEnvs.get("REFRESH_TOKEN_SECRET_KEY")
-    EMAIL_VERIFICATION_TOKEN_SECRET_KEY = OnepassEnvs.get(
-        "EMAIL_VERIFICATION_TOKEN_SECRET_KEY"
+
+@lru_cache
+def get_token_cache() -> TTLCache:
+    """
+    decoded claims per (token type, token digest), each entry lives until
+    the token's own `exp`.
+    """
+    settings = get_settings()
+    cache = TTLCache(
+        maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.ACCESS_TOKEN_EXP_MINUTES * 60
+    )
+    registry.collector("token_cache", partial(collect_cache, "token", cache))
+    return cache
+
+
+@lru_cache
+def get_recent_user_writes() -> TTLCache:
+    """
+    normalized emails of users written by this node within the replica lag
+    allowance, whose next lookup must read the primary.
+    """
+    settings = get_settings()
+    return TTLCache(
+        maxsize=settings.USER_CACHE_SIZE, ttl=settings.DB_REPLICA_MAX_LAG_SECONDS
     )
-    PASSWORD_RESET_TOKEN_SECRET_KEY = OnepassEnvs.get("PASSWORD_RESET_TOKEN_SECRET_KEY")
 
-    ALGORITHM = OnepassEnvs.get("ALGORITHM")
 
-    ACCESS_TOKEN_EXP_MINUTES = OnepassEnvs.get("ACCESS_TOKEN_EXP_MINUTES")
-    REFRESH_TOKEN_EXP_MINUTES = OnepassEnvs.get("REFRESH_TOKEN_EXP_MINUTES")
-    EMAIL_VERIFICATION_EXP_MINUTES = OnepassEnvs.get("EMAIL_VERIFICATION_EXP_MINUTES")
-    PASSWORD_RESET_EXP_MINUTES = OnepassEnvs.get("PASSWORD_RESET_EXP_MINUTES")
+class TokenKey(NamedTuple):
+    key: str
+    algorithm: str
+    exp_minutes: int
 
-    pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+class Authentication:
+    pwd_ctx = pwd_ctx
     auth_scheme = HTTPBearer()
 
+    @cached_property
+    def token_keys(self) -> Dict[TokenTypeModel, TokenKey]:
+        # read on first use so routers can build an Authentication at import.
+        settings = get_settings()
+        return {
+            TokenTypeModel.ACCESS_TOKEN: TokenKey(
+                settings.ACCESS_TOKEN_SECRET_KEY,
+                settings.ALGORITHM,
+                settings.ACCESS_TOKEN_EXP_MINUTES,
+            ),
+            TokenTypeModel.REFRESH_TOKEN: TokenKey(
+                settings.REFRESH_TOKEN_SECRET_KEY,
+                settings.ALGORITHM,
+                settings.REFRESH_TOKEN_EXP_MINUTES,
+            ),
+            TokenTypeModel.EMAIL_VERIFICATION_TOKEN: TokenKey(
+                settings.EMAIL_VERIFICATION_TOKEN_SECRET_KEY,
+                settings.ALGORITHM,
+                settings.EMAIL_VERIFICATION_EXP_MINUTES,
+            ),
+            TokenTypeModel.PASSWORD_RESET_TOKEN: TokenKey(
+                settings.PASSWORD_RESET_TOKEN_SECRET_KEY,
+                settings.ALGORITHM,
+                settings.PASSWORD_RESET_EXP_MINUTES,
+            ),
+        }
+
+    @cached_property
+    def signs_with_key_ring(self) -> bool:
+        """
+        access tokens are signed by the ES256 key ring rather than a secret.
+        """
+        return get_settings().ACCESS_TOKEN_ALGORITHM == KEY_RING_ALGORITHM
+
+    @cached_property
+    def max_token_minutes(self) -> int:
+        return max(token_key.exp_minutes for token_key in self.token_keys.values())
+
     def generate_token(self, token_type: TokenTypeModel, data: Dict[str, str]) -> str:
+        token_key = self.token_keys[token_type]
         payload = data.copy()
-        curr_date = datetime.now()
-        minutes = 0
-        token = ""
-
-        if token_type == TokenTypeModel.ACCESS_TOKEN:
-            minutes = self.ACCESS_TOKEN_EXP_MINUTES
-        elif token_type == TokenTypeModel.REFRESH_TOKEN:
-            minutes = self.REFRESH_TOKEN_EXP_MINUTES
-        elif token_type == TokenTypeModel.EMAIL_VERIFICATION_TOKEN:
-            minutes = self.EMAIL_VERIFICATION_EXP_MINUTES
-        elif token_type == TokenTypeModel.PASSWORD_RESET_TOKEN:
-            minutes = self.PASSWORD_RESET_EXP_MINUTES
+        curr_date = datetime.now(timezone.utc)
 
         payload.update(
-            {"exp": curr_date + timedelta(minutes=minutes), "iat": curr_date}
+            {
+                "exp": curr_date + timedelta(minutes=token_key.exp_minutes),
+                # sub-second iat so a revocation cutoff never catches
+                # tokens issued right after it.
+                "iat": curr_date.timestamp(),
+                "jti": uuid4().hex,
+            }
         )
 
-        if token_type == TokenTypeModel.ACCESS_TOKEN:
-            token = jwt.encode(payload, self.ACCESS_TOKEN_SECRET_KEY, self.ALGORITHM)
-        elif token_type == TokenTypeModel.REFRESH_TOKEN:
-            token = jwt.encode(payload, self.REFRESH_TOKEN_SECRET_KEY, self.ALGORITHM)
-        elif token_type == TokenTypeModel.EMAIL_VERIFICATION_TOKEN:
-            token = jwt.encode(
-                payload, self.EMAIL_VERIFICATION_TOKEN_SECRET_KEY, self.ALGORITHM
-            )
-        elif token_type == TokenTypeModel.PASSWORD_RESET_TOKEN:
-            token = jwt.encode(
-                payload, self.PASSWORD_RESET_TOKEN_SECRET_KEY, self.ALGORITHM
-            )
-
-        return token
+        with jwt_duration.time("encode"):
+            if token_type == TokenTypeModel.ACCESS_TOKEN and self.signs_with_key_ring:
+                signing_key = get_key_ring().signing_key()
+                return jwt.encode(
+                    payload,
+                    signing_key.private_key,
+                    KEY_RING_ALGORITHM,
+                    headers={"kid": signing_key.kid},
+                )
+            return jwt.encode(payload, token_key.key, token_key.algorithm)
 
-    def decode_token(
+    def _verification_key(
+        self, token: str, token_type: TokenTypeModel
+    ) -> Tuple[Any, str]:
+        """
+        key and algorithm to check `token` with. access tokens carrying a
+        `kid` are checked against the key ring, older ones without it only
+        while ACCESS_TOKEN_SECRET_KEY is still set.
+
+        Raises:
+            JWTError: for a malformed header, an unknown or retired `kid`, or
+                a token without `kid` once the secret is gone.
+        """
+        token_key = self.token_keys[token_type]
+        if token_type == TokenTypeModel.ACCESS_TOKEN and self.signs_with_key_ring:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid is not None:
+                key = get_key_ring().verification_key(kid)
+                if key is None:
+                    raise JWTError("unknown signing key")
+                return key, KEY_RING_ALGORITHM
+            if not token_key.key:
+                raise JWTError("token has no signing key id")
+        return token_key.key, token_key.algorithm
+
+    def decode_claims(
         self,
         token: str,
         token_type: TokenTypeModel,
         credential_exception: HTTPException | None,
-    ) -> str:
+    ) -> Dict[str, Any]:
         """
-        function to decode jwt token,
+        function to decode and check a jwt token, verified claims are cached
+        until the token expires so reused tokens skip signature checks.
+        revocation is checked on every call, cached or not.
 
         Args:
             token (str): jwt token
@@ -83,39 +178,98 @@ class Authentication:
             credential_exception (HTTPException | None): callback to raise exception
 
         Raises:
-            credential_exception: _description_
-            HTTPException: _description_
-            credential_exception: _description_
-            HTTPException: _description_
+            credential_exception: when given and the token is invalid,
+                expired or revoked.
+            HTTPException: 401 when the token is invalid, expired or revoked.
 
         Returns:
-            str: _description_
+            Dict[str, Any]: token claims
         """
-        try:
+        cache_key = (
+            token_type,
+            blake2b(token.encode(), digest_size=16).digest(),
+        )
+        claims = get_token_cache().get(cache_key)
 
-            key = ""
+        if claims is None:
+            try:
+                with jwt_duration.time("decode"):
+                    key, algorithm = self._verification_key(token, token_type)
+                    claims = jwt.decode(token, key=key, algorithms=[algorithm])
+            except jwt.ExpiredSignatureError:
+                if credential_exception:
+                    raise credential_exception
+                else:
+                    raise HTTPException(
+                        status_code=401, detail="Signature has expired!"
+                    )
+            except JWTError:
+                if credential_exception:
+                    raise credential_exception
+                else:
+                    raise HTTPException(status_code=401, detail="Invalid token!")
 
-            if token_type == TokenTypeModel.ACCESS_TOKEN:
-                key = self.ACCESS_TOKEN_SECRET_KEY
-            elif token_type == TokenTypeModel.REFRESH_TOKEN:
-                key = self.REFRESH_TOKEN_SECRET_KEY
-            elif token_type == TokenTypeModel.EMAIL_VERIFICATION_TOKEN:
-                key = self.EMAIL_VERIFICATION_TOKEN_SECRET_KEY
-            elif token_type == TokenTypeModel.PASSWORD_RESET_TOKEN:
-                key = self.PASSWORD_RESET_TOKEN_SECRET_KEY
+            get_token_cache().set(cache_key, claims, expires_at=claims.get("exp"))
 
-            payload = jwt.decode(token, key=key, algorithms=[self.ALGORITHM])
-            return payload["email"]
-        except jwt.ExpiredSignatureError:
-            if credential_exception:
-                raise credential_exception
-            else:
-                raise HTTPException(status_code=401, detail="Signature has expired!")
-        except JWTError:
+        if get_revocations().is_revoked(claims):
             if credential_exception:
                 raise credential_exception
             else:
-                raise HTTPException(status_code=401, detail="Invalid token!")
+                raise HTTPException(status_code=401, detail="Token has been revoked!")
+
+        return claims
+
+    def decode_token(
+        self,
+        token: str,
+        token_type: TokenTypeModel,
+        credential_exception: HTTPException | None,
+    ) -> str:
+        """
+        function to decode jwt token, see decode_claims.
+
+        Args:
+            token (str): jwt token
+            token_type (TokenTypeModel): access token or refresh token
+            credential_exception (HTTPException | None): callback to raise exception
+
+        Returns:
+            str: email claim of the token
+        """
+        return self.decode_claims(token, token_type, credential_exception)["email"]
+
+    def revoke_token(self, db: AsyncSession, claims: Dict[str, Any]):
+        """
+        revoke one token, persisted when the caller commits `db`.
+
+        Args:
+            db (AsyncSession): session the caller commits
+            claims (Dict[str, Any]): claims from decode_claims
+        """
+        if "jti" in claims:
+            get_revocations().revoke_token(db, claims)
+            return
+        # tokens issued before `jti` existed can only be revoked together
+        # with every other token of the user issued up to them.
+        get_revocations().revoke_subject(
+            db,
+            normalize_email(claims["email"]),
+            self.max_token_minutes,
+            issued_before=claims.get("iat"),
+        )
+
+    def revoke_all_tokens(self, db: AsyncSession, email: str):
+        """
+        revoke every token issued to `email` so far, persisted when the
+        caller commits `db`.
+
+        Args:
+            db (AsyncSession): session the caller commits
+            email (str): user email
+        """
+        get_revocations().revoke_subject(
+            db, normalize_email(email), self.max_token_minutes
+        )
 
     def get_pwd_hash(self, pwd: str) -> str:
         """
@@ -128,7 +282,8 @@ class Authentication:
         Returns:
             _type_: _description_
         """
-        return self.pwd_ctx.hash(pwd)
+        with password_hash_duration.time("hash"):
+            return self.pwd_ctx.hash(pwd)
 
     def verify_pwd(self, plain_pwd: str, hashed_pwd: str) -> bool:
         """
@@ -142,19 +297,85 @@ class Authentication:
         Returns:
             bool: true or false
         """
-        return self.pwd_ctx.verify(secret=plain_pwd, hash=hashed_pwd)
+        with password_hash_duration.time("verify"):
+            return self.pwd_ctx.verify(secret=plain_pwd, hash=hashed_pwd)
+
+    async def aget_pwd_hash(self, pwd: str) -> str:
+        """
+        awaitable version of get_pwd_hash, hashes in the
+        password hashing worker pool instead of the event loop.
+
+        Args:
+            pwd (str): plain password
+
+        Raises:
+            HTTPException: 503 when the hashing queue is full.
+
+        Returns:
+            str: hashed password
+        """
+        return await get_password_hasher().hash(pwd)
+
+    async def averify_pwd(self, plain_pwd: str, hashed_pwd: str) -> bool:
+        """
+        awaitable version of verify_pwd, verifies in the
+        password hashing worker pool instead of the event loop.
+
+        Args:
+            plain_pwd (str): plain password
+            hashed_pwd (str): stored hash
+
+        Raises:
+            HTTPException: 503 when the hashing queue is full.
 
-    def get_me(
+        Returns:
+            bool: true or false
+        """
+        return await get_password_hasher().verify(plain_pwd, hashed_pwd)
+
+    async def averify_and_update_pwd(
+        self, plain_pwd: str, hashed_pwd: str
+    ) -> Tuple[bool, str | None]:
+        """
+        averify_pwd that also rehashes a matching password whose stored
+        hash uses an outdated scheme or cost.
+
+        Args:
+            plain_pwd (str): plain password
+            hashed_pwd (str): stored hash
+
+        Raises:
+            HTTPException: 503 when the hashing queue is full.
+
+        Returns:
+            Tuple[bool, str | None]: true or false, and the new hash to store
+            if any.
+        """
+        return await get_password_hasher().verify_and_update(plain_pwd, hashed_pwd)
+
+    def invalidate_user(self, email: str):
+        """
+        drop a cached user, must be called after any write to that user.
+
+        Args:
+            email (str): user email
+        """
+        key = normalize_email(email)
+        get_user_cache().invalidate(key)
+        # so a lagging replica cannot put the old row back in the cache.
+        get_recent_user_writes().set(key, True)
+
+    async def get_me(
         self,
         token: HTTPAuthorizationCredentials = Depends(auth_scheme),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_read_db),
     ) -> UserResponseModel:
         """
         get logged in user.
 
         Args:
             token (HTTPAuthorizationCredentials, optional): _description_. Defaults to Depends(auth_scheme).
-            db (Session, optional): _description_. Defaults to Depends(get_db).
+            db (AsyncSession, optional): read session. Defaults to Depends(get_read_db).
 
         Returns:
             UserResponseModel: _description_
@@ -169,6 +390,26 @@ class Authentication:
             token_type=TokenTypeModel.ACCESS_TOKEN,
             credential_exception=credentials_exception,
         )
-        statement = select(Users).where(Users.email == user_email)
-        result = db.exec(statement=statement).one_or_none()
-        return UserResponseModel(**result.__dict__)
+        cache_key = normalize_email(user_email)
+        user = get_user_cache().get(cache_key)
+        if user is not None:
+            return user
+
+        result = await read_one(
+            db,
+            select_user_by_email(user_email),
+            recheck=lambda row: row is None,
+            fresh=get_recent_user_writes().get(cache_key, False),
+        )
+        if result is None:
+            raise credentials_exception
+
+        # the row comes from the database, so skip validating it again.
+        user = UserResponseModel.model_construct(
+            **{name: getattr(result, name) for name in UserResponseModel.model_fields}
+        )
+        get_user_cache().set(cache_key, user)
+        # hand the connection back now rather than after the request, which
+        # may be a long upload or download.
+        await db.close()
+        return user
@@ -0,0 +1,115 @@
+import hashlib
+import mmap
+import os
+import struct
+from functools import lru_cache
+from config.env import get_settings
+from utils.metrics import breached_passwords_rejected
+
+# file layout, all integers little-endian:
+#   header: magic, version, record size, record count
+#   prefix table: 65537 record indexes, entry p is the first record whose
+#     first two bytes are >= p, the last one is the record count
+#   records: sorted, unique 20 byte SHA-1 digests
+MAGIC = b"OPBREACH"
+VERSION = 1
+RECORD_SIZE = 20
+HEADER = struct.Struct("<8sIIQ")
+PREFIXES = 1 << 16
+TABLE_ENTRY = struct.Struct("<Q")
+TABLE_OFFSET = HEADER.size
+RECORDS_OFFSET = TABLE_OFFSET + (PREFIXES + 1) * TABLE_ENTRY.size
+
+# a (start, end) pair of the prefix table.
+_BUCKET = struct.Struct("<QQ")
+
+
+class BreachIndexError(Exception):
+    pass
+
+
+def password_digest(password: str) -> bytes:
+    # the published breach corpora hash the UTF-8 password.
+    return hashlib.sha1(password.encode()).digest()
+
+
+class BreachIndex:
+    """
+    read-only, memory-mapped set of breached password SHA-1 digests, in the
+    format written by `python -m tools.build_breach_index`.
+
+    a lookup reads one prefix table entry and binary searches its bucket,
+    a few dozen bytes of the file, so the dataset stays in the page cache
+    rather than the heap whatever its size.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < RECORDS_OFFSET:
+                raise BreachIndexError(f"{path} is not a breach index")
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, self.count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self._mmap.close()
+            raise BreachIndexError(f"{path} is not a version {VERSION} breach index")
+        if size != RECORDS_OFFSET + self.count * RECORD_SIZE:
+            self._mmap.close()
+            raise BreachIndexError(f"{path} is truncated")
+        if hasattr(self._mmap, "madvise"):
+            # lookups jump around, readahead would only evict useful pages.
+            self._mmap.madvise(mmap.MADV_RANDOM)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, digest: bytes) -> bool:
+        data = self._mmap
+        prefix = int.from_bytes(digest[:2], "big")
+        low, high = _BUCKET.unpack_from(
+            data, TABLE_OFFSET + prefix * TABLE_ENTRY.size
+        )
+        while low < high:
+            middle = (low + high) // 2
+            offset = RECORDS_OFFSET + middle * RECORD_SIZE
+            record = data[offset : offset + RECORD_SIZE]
+            if record < digest:
+                low = middle + 1
+            elif record > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def contains_password(self, password: str) -> bool:
+        return password_digest(password) in self
+
+    def close(self):
+        self._mmap.close()
+
+
+@lru_cache
+def get_breach_index() -> BreachIndex | None:
+    """
+    the index at BREACHED_PASSWORDS_PATH, None when the check is disabled.
+    """
+    path = get_settings().BREACHED_PASSWORDS_PATH
+    return BreachIndex(path) if path else None
+
+
+def ensure_not_breached(password: str) -> str:
+    """
+    pydantic validator body for new passwords.
+
+    Raises:
+        ValueError: the password is in the breach index.
+    """
+    index = get_breach_index()
+    if index is not None and index.contains_password(password):
+        breached_passwords_rejected.inc()
+        raise ValueError(
+            "This password has appeared in a data breach, please choose another."
+        )
+    return password
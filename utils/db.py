@@ -1,22 +1,280 @@
-from os import environ
-from typing import Any, Generator
-from sqlmodel import create_engine, Session
-from config.env import OnepassEnvs
+import asyncio
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Callable, List, Sequence, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from config.env import get_settings
 from schemas import SQLModel
+from utils.metrics import (
+    db_replica_fallbacks,
+    db_replica_healthy,
+    db_replica_lag,
+    instrument_engine,
+)
+from utils.migrations import run_migrations
 
-ENV = OnepassEnvs.get("ENV")
-DB_NAME = OnepassEnvs.get("DB_NAME")
-DB_USER = OnepassEnvs.get("DB_USER")
-DB_HOSTNAME = OnepassEnvs.get("DB_HOSTNAME")
-DB_PWD = OnepassEnvs.get("DB_PWD")
+_engine: AsyncEngine | None = None
+_sessionmaker: async_sessionmaker[AsyncSession] | None = None
 
-db_url = f"postgresql://{DB_USER}:{DB_PWD}@{DB_HOSTNAME}/{DB_NAME}"
-engine = create_engine(db_url, echo=True if ENV == "dev" else False)
+# seconds the replica is behind, 0 when it has replayed everything it
+# received (an idle primary would otherwise look like growing lag).
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM "
+    "now() - pg_last_xact_replay_timestamp()), 0) END"
+)
 
 
-def get_db() -> Generator[Session, Any, None]:
-    db = Session(bind=engine)
-    try:
+def _create_engine(url: str | URL) -> AsyncEngine:
+    settings = get_settings()
+    engine = create_async_engine(
+        url,
+        echo=True if settings.ENV == "dev" else False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        connect_args={
+            "server_settings": {
+                "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS),
+            },
+        },
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+def get_engine() -> AsyncEngine:
+    """
+    the shared engine, created on first use (normally by `init_db` in the
+    app lifespan) so importing this module never needs the database settings.
+    """
+    global _engine, _sessionmaker
+    if _engine is None:
+        settings = get_settings()
+        _engine = _create_engine(
+            f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PWD}"
+            f"@{settings.DB_HOSTNAME}/{settings.DB_NAME}"
+        )
+        _sessionmaker = async_sessionmaker(
+            _engine, class_=AsyncSession, expire_on_commit=False
+        )
+    return _engine
+
+
+class Replica:
+    def __init__(self, url: str):
+        url = make_url(url).set(drivername="postgresql+asyncpg")
+        self.name = f"{url.host}:{url.port or 5432}/{url.database}"
+        self.engine = _create_engine(url)
+        # sessions carry their replica so reads can fall back from it.
+        self.sessionmaker = async_sessionmaker(
+            self.engine,
+            class_=AsyncSession,
+            expire_on_commit=False,
+            info={"replica": self},
+        )
+        self.healthy = False
+        self.lag: float | None = None
+
+
+class ReplicaSet:
+    """
+    read replicas behind `read_session`.
+
+    a replica is healthy while it answers the lag query within
+    `check_interval` and is at most `max_lag` seconds behind. reads go round
+    robin over the healthy replicas, or to the primary when there is none.
+    """
+
+    def __init__(self, urls: Sequence[str], max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [Replica(url) for url in urls]
+
+        self._healthy: List[Replica] = []
+        self._cursor = 0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def pick(self) -> Replica | None:
+        healthy = self._healthy
+        if not healthy:
+            return None
+        self._cursor = (self._cursor + 1) % len(healthy)
+        return healthy[self._cursor]
+
+    def _set_health(self, replica: Replica, healthy: bool, reason: str = ""):
+        if replica.healthy != healthy:
+            state = "healthy" if healthy else f"unhealthy, {reason}"
+            print(f"Replica {replica.name} is {state}.")
+        replica.healthy = healthy
+        db_replica_healthy.set(replica.name, value=1 if healthy else 0)
+        self._healthy = [replica for replica in self.replicas if replica.healthy]
+
+    def mark_down(self, replica: Replica, error: Exception):
+        """
+        take a replica out of rotation until its next successful check.
+        """
+        self._set_health(replica, False, f"{type(error).__name__}: {error}")
+
+    async def _lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            return float(await conn.scalar(REPLICA_LAG_QUERY))
+
+    async def check_one(self, replica: Replica):
+        try:
+            lag = await asyncio.wait_for(self._lag(replica), self.check_interval)
+        except (asyncio.TimeoutError, DBAPIError, OSError) as error:
+            replica.lag = None
+            self.mark_down(replica, error)
+            return
+
+        replica.lag = lag
+        db_replica_lag.set(replica.name, value=lag)
+        if lag > self.max_lag:
+            self._set_health(replica, False, f"{lag:.1f}s behind")
+        else:
+            self._set_health(replica, True)
+
+    async def check(self):
+        await asyncio.gather(*(self.check_one(replica) for replica in self.replicas))
+
+    async def start(self):
+        if not self.replicas:
+            return
+        await self.check()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="replica-check")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+            replica.healthy = False
+        self._healthy = []
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception as error:
+                print(f"Replica check failed: {error}")
+
+
+@lru_cache
+def get_replicas() -> ReplicaSet:
+    settings = get_settings()
+    return ReplicaSet(
+        settings.DB_REPLICA_URLS,
+        max_lag=settings.DB_REPLICA_MAX_LAG_SECONDS,
+        check_interval=settings.DB_REPLICA_CHECK_SECONDS,
+    )
+
+
+def async_session() -> AsyncSession:
+    """
+    a new session on the shared engine, for work outside a request.
+    """
+    if _sessionmaker is None:
+        get_engine()
+    return _sessionmaker()
+
+
+def read_session() -> AsyncSession:
+    """
+    a new session on a healthy replica, or on the primary when there is none.
+    only for reads that can tolerate DB_REPLICA_MAX_LAG_SECONDS of lag.
+    """
+    replica = get_replicas().pick()
+    if replica is None:
+        return async_session()
+    return replica.sessionmaker()
+
+
+async def read_one(
+    db: AsyncSession,
+    statement,
+    recheck: Callable[[Any], bool] | None = None,
+    fresh: bool = False,
+) -> Any:
+    """
+    `one_or_none` of `statement` on a session from `get_read_db`.
+
+    the primary answers instead when the replica fails, when `fresh` is set
+    (the caller just wrote the row), or when `recheck(row)` is true, i.e.
+    the result could come from a replica that missed a recent write.
+    """
+    row, _ = await read_one_from(db, statement, recheck, fresh)
+    return row
+
+
+async def read_one_from(
+    db: AsyncSession,
+    statement,
+    recheck: Callable[[Any], bool] | None = None,
+    fresh: bool = False,
+) -> Tuple[Any, bool]:
+    """
+    like `read_one`, also telling whether a replica answered, i.e. whether
+    a primary read could still return something newer.
+
+    Returns:
+        Tuple[Any, bool]: the row or None, and whether it came from a replica
+    """
+    replica = db.info.get("replica")
+    if replica is None:
+        return (await db.exec(statement=statement)).one_or_none(), False
+
+    if fresh:
+        db_replica_fallbacks.inc("fresh")
+    else:
+        try:
+            row = (await db.exec(statement=statement)).one_or_none()
+        except (DBAPIError, OSError) as error:
+            get_replicas().mark_down(replica, error)
+            db_replica_fallbacks.inc("error")
+        else:
+            if recheck is None or not recheck(row):
+                return row, True
+            db_replica_fallbacks.inc("recheck")
+
+    async with async_session() as primary:
+        return (await primary.exec(statement=statement)).one_or_none(), False
+
+
+async def init_db():
+    await run_migrations(get_engine(), SQLModel.metadata)
+    await get_replicas().start()
+
+
+async def close_db():
+    global _engine, _sessionmaker
+    await get_replicas().close()
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _sessionmaker = None
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session() as db:
+        yield db
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    like `get_db`, for read-only endpoints, see `read_session` and `read_one`.
+    """
+    async with read_session() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from functools import lru_cache, partial
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from fastapi import HTTPException, status
+from config.env import get_settings
+from utils.cache import TTLCache
+from utils.metrics import collect_cache, registry
+
+
+class DeliverabilityChecker:
+    """
+    async MX/A lookups for email domains with a per-domain TTL cache.
+
+    concurrent checks for the same domain share one lookup. resolver
+    failures (timeouts, no nameservers) fail open and are cached briefly
+    so a flaky resolver does not block registrations.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        cache_size: int,
+        ttl: float,
+        error_ttl: float,
+        timeout: float,
+    ):
+        self.enabled = enabled
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._pending: dict[str, asyncio.Future] = {}
+        self._resolver: dns.asyncresolver.Resolver | None = None
+
+    def _get_resolver(self) -> dns.asyncresolver.Resolver:
+        if self._resolver is None:
+            self._resolver = dns.asyncresolver.Resolver()
+            self._resolver.lifetime = self.timeout
+        return self._resolver
+
+    async def _has_records(self, domain: str, rdtype: str) -> bool:
+        try:
+            answer = await self._get_resolver().resolve(domain, rdtype)
+        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+            return False
+
+        if rdtype == "MX":
+            # RFC 7505 null MX, the domain explicitly accepts no mail.
+            return not all(str(r.exchange) == "." for r in answer)
+        return True
+
+    async def _lookup(self, domain: str) -> bool:
+        try:
+            for rdtype in ("MX", "A", "AAAA"):
+                if await self._has_records(domain, rdtype):
+                    deliverable = True
+                    break
+            else:
+                deliverable = False
+        except dns.resolver.NXDOMAIN:
+            deliverable = False
+        except dns.exception.DNSException:
+            self.cache.set(domain, True, expires_at=time.time() + self.error_ttl)
+            return True
+
+        self.cache.set(domain, deliverable)
+        return deliverable
+
+    async def is_deliverable(self, email: str) -> bool:
+        domain = email.rsplit("@", 1)[-1].lower()
+
+        cached = self.cache.get(domain)
+        if cached is not None:
+            return cached
+
+        pending = self._pending.get(domain)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(domain))
+            self._pending[domain] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(domain, None))
+        return await asyncio.shield(pending)
+
+    async def ensure(self, email: str):
+        """
+        raise a 422 when the email's domain cannot receive mail.
+
+        Args:
+            email (str): email to check
+
+        Raises:
+            HTTPException: 422 for undeliverable domains
+        """
+        if not self.enabled:
+            return
+
+        if not await self.is_deliverable(email):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="The domain of this email does not accept email.",
+            )
+
+
+@lru_cache
+def get_email_deliverability() -> DeliverabilityChecker:
+    settings = get_settings()
+    checker = DeliverabilityChecker(
+        enabled=settings.EMAIL_DELIVERABILITY_CHECKS,
+        cache_size=settings.DNS_CACHE_SIZE,
+        ttl=settings.DNS_CACHE_TTL_SECONDS,
+        error_ttl=settings.DNS_ERROR_TTL_SECONDS,
+        timeout=settings.DNS_TIMEOUT_SECONDS,
+    )
+    registry.collector("dns_cache", partial(collect_cache, "dns", checker.cache))
+    return checker
@@ -0,0 +1,292 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, NamedTuple, Tuple
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from passlib.hash import argon2, bcrypt
+from config.env import get_settings
+from utils.metrics import (
+    collect_password_hasher,
+    password_hash_duration,
+    password_hash_wait,
+    registry,
+)
+
+# calibration never goes below these, whatever the latency budget.
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 20
+MIN_ARGON2_TIME_COST = 2
+MAX_ARGON2_TIME_COST = 64
+
+
+class HashParams(NamedTuple):
+    scheme: str
+    bcrypt_rounds: int
+    argon2_time_cost: int
+    argon2_memory_kib: int
+    argon2_parallelism: int
+
+    def context_config(self) -> Dict[str, Any]:
+        """
+        CryptContext settings for these parameters. hashes made with another
+        scheme or with a lower cost report `needs_update`.
+        """
+        return {
+            "schemes": ["argon2", "bcrypt"],
+            "default": self.scheme,
+            "deprecated": "auto",
+            "bcrypt__rounds": self.bcrypt_rounds,
+            "bcrypt__min_rounds": self.bcrypt_rounds,
+            "argon2__type": "ID",
+            "argon2__rounds": self.argon2_time_cost,
+            "argon2__min_rounds": self.argon2_time_cost,
+            "argon2__memory_cost": self.argon2_memory_kib,
+            "argon2__parallelism": self.argon2_parallelism,
+        }
+
+    def describe(self) -> str:
+        if self.scheme == "argon2":
+            return (
+                f"argon2id t={self.argon2_time_cost} m={self.argon2_memory_kib}KiB "
+                f"p={self.argon2_parallelism}"
+            )
+        return f"bcrypt rounds={self.bcrypt_rounds}"
+
+
+def _time_hash(handler, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        handler.hash("calibration-password")
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def calibrate(params: HashParams, target_ms: float) -> Tuple[HashParams, float]:
+    """
+    pick the highest cost of `params.scheme` whose hash time on this
+    machine stays within `target_ms`, never below the MIN_* floors.
+
+    bcrypt cost doubles per round, so rounds are extrapolated from a cheap
+    measurement; argon2 time grows linearly with time_cost at fixed memory.
+
+    Returns:
+        Tuple[HashParams, float]: calibrated parameters and their measured
+        hash time in milliseconds.
+    """
+    target = target_ms / 1000
+    if params.scheme == "argon2":
+        handler = argon2.using(
+            type="ID",
+            rounds=1,
+            memory_cost=params.argon2_memory_kib,
+            parallelism=params.argon2_parallelism,
+        )
+        time_cost = int(target / _time_hash(handler))
+        time_cost = max(MIN_ARGON2_TIME_COST, min(MAX_ARGON2_TIME_COST, time_cost))
+        params = params._replace(argon2_time_cost=time_cost)
+        handler = handler.using(rounds=time_cost)
+    else:
+        base_rounds = 8
+        elapsed = _time_hash(bcrypt.using(rounds=base_rounds))
+        rounds = base_rounds + int(math.floor(math.log2(target / elapsed)))
+        rounds = max(MIN_BCRYPT_ROUNDS, min(MAX_BCRYPT_ROUNDS, rounds))
+        params = params._replace(bcrypt_rounds=rounds)
+        handler = bcrypt.using(rounds=rounds)
+
+    return params, _time_hash(handler, repeat=1) * 1000
+
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _configure(config: Dict[str, Any]):
+    # runs in each pool worker, and in this process, so all hash alike.
+    pwd_ctx.load(config)
+
+
+def _hash(pwd: str) -> str:
+    return pwd_ctx.hash(pwd)
+
+
+def _verify(plain_pwd: str, hashed_pwd: str) -> bool:
+    return pwd_ctx.verify(secret=plain_pwd, hash=hashed_pwd)
+
+
+def _verify_and_update(plain_pwd: str, hashed_pwd: str) -> Tuple[bool, str | None]:
+    return pwd_ctx.verify_and_update(secret=plain_pwd, hash=hashed_pwd)
+
+
+class PasswordHasher:
+    """
+    bounded process pool that runs password hashing off the event loop.
+
+    at most `workers` hashes run at once; up to `max_queue` more callers
+    may wait for a slot for `queue_timeout` seconds. anything beyond that
+    is rejected with a 503 so a login burst cannot pile up unbounded work.
+
+    with `target_ms` set, `configure` calibrates the cost of `params` to
+    that per-hash budget, making capacity about 1000 / target_ms logins
+    per second per worker.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue: int,
+        queue_timeout: float,
+        params: HashParams,
+        target_ms: float = 0,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.params = params
+        self.target_ms = target_ms
+        self.hash_ms: float | None = None
+        self._configured = False
+
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def configure(self):
+        """
+        calibrate if a latency budget is set, then load the parameters
+        into `pwd_ctx`. runs once, before the pool starts.
+        """
+        if self._configured:
+            return
+
+        if self.target_ms:
+            self.params, self.hash_ms = calibrate(self.params, self.target_ms)
+            print(
+                f"Password hashing calibrated to {self.params.describe()}, "
+                f"{self.hash_ms:.0f} ms per hash "
+                f"(budget {self.target_ms:.0f} ms, "
+                f"~{1000 / self.hash_ms:.1f} per second per worker)."
+            )
+            if self.hash_ms > self.target_ms * 1.5:
+                print("Password hashing exceeds its budget at the minimum cost.")
+        _configure(self.params.context_config())
+        self._configured = True
+
+    def start(self):
+        if self._pool is None:
+            self.configure()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_configure,
+                initargs=(self.params.context_config(),),
+            )
+            self._slots = asyncio.Semaphore(self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._slots = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "params": self.params.describe(),
+            "hash_ms": self.hash_ms,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+    def _overloaded(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        self.start()
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise self._overloaded()
+
+        self.queue_depth += 1
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise self._overloaded()
+        finally:
+            self.queue_depth -= 1
+            waited = time.perf_counter() - queued_at
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            password_hash_wait.observe(waited)
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with password_hash_duration.time(operation):
+                return await loop.run_in_executor(self._pool, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, pwd: str) -> str:
+        return await self._run("hash", _hash, pwd)
+
+    async def verify(self, plain_pwd: str, hashed_pwd: str) -> bool:
+        return await self._run("verify", _verify, plain_pwd, hashed_pwd)
+
+    async def verify_and_update(
+        self, plain_pwd: str, hashed_pwd: str
+    ) -> Tuple[bool, str | None]:
+        """
+        Returns:
+            Tuple[bool, str | None]: whether the password matches, and a new
+            hash when the stored one uses an outdated scheme or cost.
+        """
+        return await self._run(
+            "verify", _verify_and_update, plain_pwd, hashed_pwd
+        )
+
+
+@lru_cache
+def get_password_hasher() -> PasswordHasher:
+    settings = get_settings()
+    hasher = PasswordHasher(
+        workers=settings.PWD_HASH_WORKERS,
+        max_queue=settings.PWD_HASH_MAX_QUEUE,
+        queue_timeout=settings.PWD_HASH_QUEUE_TIMEOUT_SECONDS,
+        params=HashParams(
+            scheme=settings.PWD_HASH_SCHEME,
+            bcrypt_rounds=settings.PWD_HASH_BCRYPT_ROUNDS,
+            argon2_time_cost=settings.PWD_HASH_ARGON2_TIME_COST,
+            argon2_memory_kib=settings.PWD_HASH_ARGON2_MEMORY_KIB,
+            argon2_parallelism=settings.PWD_HASH_ARGON2_PARALLELISM,
+        ),
+        target_ms=settings.PWD_HASH_TARGET_MS,
+    )
+    registry.collector("password_hasher", partial(collect_password_hasher, hasher))
+    return hasher
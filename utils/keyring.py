@@ -0,0 +1,272 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+from uuid import uuid4
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+)
+from jose import jwk
+from jose.backends.base import Key
+from pydantic_core import to_json
+from sqlalchemy import delete, func, or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from config.env import get_settings
+from schemas import SigningKey
+from utils.db import async_session
+from utils.locks import ROTATION_LOCK_ID
+
+ALGORITHM = "ES256"
+
+# private keys written before they were encrypted at rest.
+PLAINTEXT_PREFIX = "-----BEGIN"
+
+
+class LoadedKey(NamedTuple):
+    kid: str
+    activates_at: float
+    retires_at: float | None
+    private_key: Key
+    public_key: Key
+
+
+def generate_key(kid: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns:
+        Tuple[str, Dict[str, Any]]: PKCS8 PEM private key and its public JWK
+    """
+    private_pem = (
+        ec.generate_private_key(ec.SECP256R1())
+        .private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+        .decode()
+    )
+    public_jwk = jwk.construct(private_pem, ALGORITHM).public_key().to_dict()
+    public_jwk.update(kid=kid, use="sig")
+    return private_pem, public_jwk
+
+
+class KeyRing:
+    """
+    ES256 access token keys, fronting the signing_keys table.
+
+    the newest active key signs, every key that has not retired verifies.
+    `sync` creates the next key `publish_ahead` seconds before it is due, so
+    other nodes and JWKS caches know it before it signs anything, and
+    retires the previous key once the last tokens it signed have expired.
+
+    private keys are stored encrypted with `cipher`, so the table, its
+    replicas and backups are of no use without the encryption keys.
+    """
+
+    def __init__(
+        self,
+        cipher: MultiFernet | None,
+        rotation_interval: float,
+        publish_ahead: float,
+        token_lifetime: float,
+        sync_interval: float,
+    ):
+        self.cipher = cipher
+        self.rotation_interval = rotation_interval
+        self.publish_ahead = publish_ahead
+        self.token_lifetime = token_lifetime
+        self.sync_interval = sync_interval
+
+        self._keys: Dict[str, LoadedKey] = {}
+        self._signing: LoadedKey | None = None
+        # activation time of the next pending key, re-select signing then.
+        self._switch_at = float("inf")
+        self._jwks = to_json({"keys": []})
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def signing_key(self) -> LoadedKey:
+        """
+        Raises:
+            RuntimeError: when no key is active, i.e. the ring never synced.
+        """
+        if time.time() >= self._switch_at:
+            self._select()
+        if self._signing is None:
+            raise RuntimeError("no active signing key, is the key ring started?")
+        return self._signing
+
+    def verification_key(self, kid: str) -> Key | None:
+        key = self._keys.get(kid)
+        if key is None:
+            return None
+        if key.retires_at is not None and key.retires_at <= time.time():
+            return None
+        return key.public_key
+
+    def jwks(self) -> bytes:
+        """
+        Returns:
+            bytes: rendered JWKS document of every published key
+        """
+        return self._jwks
+
+    def _select(self):
+        now = time.time()
+        starts = [key.activates_at for key in self._keys.values()]
+        active = [key for key in self._keys.values() if key.activates_at <= now]
+        self._signing = max(active, key=lambda key: key.activates_at, default=None)
+        self._switch_at = min(
+            (start for start in starts if start > now), default=float("inf")
+        )
+
+    def _decrypt(self, row: SigningKey) -> str:
+        """
+        Raises:
+            RuntimeError: when no JWT_KEY_ENCRYPTION_KEYS entry decrypts it.
+        """
+        if row.private_key.startswith(PLAINTEXT_PREFIX):
+            return row.private_key
+        try:
+            return self.cipher.decrypt(row.private_key.encode()).decode()
+        except InvalidToken:
+            raise RuntimeError(
+                f"cannot decrypt signing key {row.kid}, "
+                "is its key missing from JWT_KEY_ENCRYPTION_KEYS?"
+            )
+
+    def _encrypt(self, private_pem: str) -> str:
+        return self.cipher.encrypt(private_pem.encode()).decode()
+
+    def _load(self, rows: Sequence[SigningKey]):
+        keys = {}
+        for row in rows:
+            retires_at = row.retires_at.timestamp() if row.retires_at else None
+            current = self._keys.get(row.kid)
+            if current is not None:
+                # keys never change once written, only their retirement.
+                keys[row.kid] = current._replace(retires_at=retires_at)
+                continue
+            keys[row.kid] = LoadedKey(
+                kid=row.kid,
+                activates_at=row.activates_at.timestamp(),
+                retires_at=retires_at,
+                private_key=jwk.construct(self._decrypt(row), row.algorithm),
+                public_key=jwk.construct(row.public_jwk, row.algorithm),
+            )
+        self._keys = keys
+        newest_first = sorted(rows, key=lambda row: row.activates_at, reverse=True)
+        self._jwks = to_json({"keys": [row.public_jwk for row in newest_first]})
+        self._select()
+
+    def _needs_rotation(
+        self, rows: Sequence[SigningKey], curr_date: datetime
+    ) -> bool:
+        if not rows:
+            return True
+        newest = max(row.activates_at for row in rows)
+        if newest > curr_date:
+            # the next key is already published.
+            return False
+        due = newest + timedelta(seconds=self.rotation_interval - self.publish_ahead)
+        return due <= curr_date
+
+    async def _published(
+        self, db: AsyncSession, curr_date: datetime
+    ) -> List[SigningKey]:
+        statement = select(SigningKey).where(
+            SigningKey.algorithm == ALGORITHM,
+            or_(SigningKey.retires_at == None, SigningKey.retires_at > curr_date),
+        )
+        return list((await db.exec(statement=statement)).all())
+
+    async def _rotate(
+        self, db: AsyncSession, curr_date: datetime
+    ) -> List[SigningKey]:
+        # one node rotates, the others wait here and find the new key.
+        await db.exec(statement=select(func.pg_advisory_xact_lock(ROTATION_LOCK_ID)))
+        rows = await self._published(db, curr_date)
+        if not self._needs_rotation(rows, curr_date):
+            return rows
+
+        # the very first key signs right away, later ones are announced first.
+        activates_at = curr_date
+        if rows:
+            activates_at += timedelta(seconds=self.publish_ahead)
+        for row in rows:
+            if row.retires_at is None:
+                row.retires_at = activates_at + timedelta(seconds=self.token_lifetime)
+                db.add(row)
+
+        kid = f"{curr_date:%Y%m%d}-{uuid4().hex[:8]}"
+        private_pem, public_jwk = generate_key(kid)
+        key = SigningKey(
+            kid=kid,
+            algorithm=ALGORITHM,
+            private_key=self._encrypt(private_pem),
+            public_jwk=public_jwk,
+            created_at=curr_date,
+            activates_at=activates_at,
+        )
+        db.add(key)
+        print(f"Created signing key {kid}, active from {activates_at}.")
+        return rows + [key]
+
+    async def sync(self):
+        """
+        load keys published by any node, rotate when due and delete
+        retired keys.
+        """
+        curr_date = datetime.now()
+        async with async_session() as db:
+            rows = await self._published(db, curr_date)
+            if self._needs_rotation(rows, curr_date):
+                rows = await self._rotate(db, curr_date)
+            for row in rows:
+                if row.private_key.startswith(PLAINTEXT_PREFIX):
+                    row.private_key = self._encrypt(row.private_key)
+                    db.add(row)
+                    print(f"Encrypted signing key {row.kid}.")
+            await db.exec(
+                statement=delete(SigningKey).where(SigningKey.retires_at <= curr_date)
+            )
+            await db.commit()
+        self._load(rows)
+
+    async def start(self):
+        await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="key-ring-sync")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as error:
+                print(f"Key ring sync failed: {error}")
+
+
+@lru_cache
+def get_key_ring() -> KeyRing:
+    settings = get_settings()
+    # only ES256 starts the ring, and requires the keys.
+    cipher = None
+    if settings.JWT_KEY_ENCRYPTION_KEYS:
+        cipher = MultiFernet([Fernet(key) for key in settings.JWT_KEY_ENCRYPTION_KEYS])
+    return KeyRing(
+        cipher=cipher,
+        rotation_interval=settings.JWT_KEY_ROTATION_DAYS * 86400,
+        publish_ahead=settings.JWT_KEY_PUBLISH_AHEAD_SECONDS,
+        token_lifetime=settings.ACCESS_TOKEN_EXP_MINUTES * 60,
+        sync_interval=settings.JWT_KEY_SYNC_SECONDS,
+    )
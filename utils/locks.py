@@ -0,0 +1,6 @@
+# postgres advisory lock ids, one per job that only one node may run at a
+# time. they live together so that no two jobs ever share an id; each is
+# its job's name in ascii.
+MIGRATION_LOCK_ID = 0x6D696772  # "migr"
+PARTITION_LOCK_ID = 0x61756474  # "audt"
+ROTATION_LOCK_ID = 0x6F6E6550  # "oneP"
@@ -1,86 +1,354 @@
-from typing import List
-from fastapi import BackgroundTasks
-from pathlib import Path
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from config.env import OnepassEnvs
+import asyncio
+import time
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Any, Dict, List
+import aiosmtplib
+from config.env import Settings, get_settings
 from models.emails import EmailModel
-from datetime import datetime
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=OnepassEnvs.get("EMAIL_USERNAME"),
-    MAIL_PASSWORD=OnepassEnvs.get("EMAIL_PASSWORD"),
-    MAIL_FROM=(OnepassEnvs.get("EMAIL_FROM")),
-    MAIL_PORT=OnepassEnvs.get("EMAIL_PORT"),
-    MAIL_SERVER=OnepassEnvs.get("EMAIL_SERVER"),
-    MAIL_FROM_NAME=OnepassEnvs.get("EMAIL_FROM_NAME"),
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    MAIL_DEBUG=True,
-    TEMPLATE_FOLDER=Path(__file__).parent.parent / "templates",
+from utils.metrics import (
+    collect_mail_dispatcher,
+    mail_send_duration,
+    mail_send_failures,
+    registry,
 )
+from utils.templates import TEMPLATE_FOLDER, MailTemplates, mail_templates
 
+if TYPE_CHECKING:
+    from fastapi_mail import ConnectionConfig
 
-async def send_email_with_template(email_data: EmailModel):
-    """_summary_
 
-    Args:
-        email_data (EmailModel): _description_
+def mail_config(settings: Settings) -> "ConnectionConfig":
+    # fastapi_mail pulls in httpx and friends, only import it when needed.
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME=settings.EMAIL_USERNAME,
+        MAIL_PASSWORD=settings.EMAIL_PASSWORD,
+        MAIL_FROM=settings.EMAIL_FROM,
+        MAIL_PORT=settings.EMAIL_PORT,
+        MAIL_SERVER=settings.EMAIL_SERVER,
+        MAIL_FROM_NAME=settings.EMAIL_FROM_NAME,
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=settings.EMAIL_USE_TLS,
+        USE_CREDENTIALS=settings.EMAIL_USE_CREDENTIALS,
+        MAIL_DEBUG=True,
+        TEMPLATE_FOLDER=TEMPLATE_FOLDER,
+    )
 
-    Raises:
-        HTTPException: _description_
 
-    Returns:
-        _type_: _description_
+class MailDispatcherStopped(Exception):
+    """
+    the dispatcher stopped before the message was sent.
     """
 
-    email_data.template_body.__setattr__(
-        "copyright_text",
-        f"Copyright © {datetime.now().year}. FluxTech, All rights reserved.",
-    )
-    message = MessageSchema(
-        subject=email_data.subject,
-        recipients=email_data.email_to,
-        template_body=email_data.template_body,
-        subtype=MessageType.html,
-    )
+    def __init__(self):
+        super().__init__("mail dispatcher stopped")
 
-    fm = FastMail(conf)
-    await fm.send_message(message=message, template_name=email_data.template_name)
 
+class _Delivery:
+    __slots__ = ("email_data", "future", "attempts")
 
-def send_mail_in_background(background_tasks: BackgroundTasks, email_data: EmailModel):
-    """
-    background task function to send mails.
+    def __init__(self, email_data: EmailModel, future: asyncio.Future):
+        self.email_data = email_data
+        self.future = future
+        self.attempts = 0
 
-    Args:
-        background_tasks (BackgroundTasks): _description_
-        subject (str): _description_
-        email_to (List[str]): _description_
-        body (dict): _description_
-        template_name (str): _description_
 
-    Raises:
-        HTTPException: _description_
+class MailDispatcher:
+    """
+    long-lived mail delivery worker.
 
-    Returns:
-        _type_: _description_
+    each of the `connections` workers keeps one authenticated SMTP
+    connection open and drains the shared queue in batches of up to
+    `batch_size` messages. failed sends reconnect and are requeued with
+    exponential backoff, up to `max_retries` times.
     """
 
-    email_data.template_body["copyright_text"] = (
-        f"Copyright © {datetime.now().year}. FluxTech, All rights reserved.",
-    )
-    message = MessageSchema(
-        subject=email_data.subject,
-        recipients=email_data.email_to,
-        template_body=email_data.template_body,
-        subtype=MessageType.html,
-    )
+    def __init__(
+        self,
+        config: "ConnectionConfig",
+        templates: MailTemplates,
+        connections: int,
+        batch_size: int,
+        max_queue: int,
+        max_retries: int,
+        retry_backoff: float,
+    ):
+        self.config = config
+        self.templates = templates
+        self.connections = connections
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
 
-    fm = FastMail(conf)
-    background_tasks.add_task(
-        fm.send_message, message=message, template_name=email_data.template_name
-    )
+        self._queue: asyncio.Queue[_Delivery] | None = None
+        self._workers: List[asyncio.Task] = []
+        # deliveries waiting out their retry backoff, outside the queue.
+        self._retries: Dict[_Delivery, asyncio.TimerHandle] = {}
+        self._stopping = False
+        self._abandoned: List[_Delivery] = []
+
+        self.started_at = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.open_connections = 0
+
+    async def start(self):
+        if self._workers:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self.started_at = time.monotonic()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"mail-worker-{i}")
+            for i in range(self.connections)
+        ]
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        let the queue drain for up to `timeout` seconds, then stop workers.
+
+        messages still queued, in a worker's batch or waiting to be retried
+        are dropped, their futures fail with `MailDispatcherStopped`.
+        """
+        if not self._workers:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        # from here on a failed send gives up instead of scheduling a retry.
+        self._stopping = True
+        dropped = list(self._retries)
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        while not self._queue.empty():
+            dropped.append(self._queue.get_nowait())
+            self._queue.task_done()
+        # failed first, so workers do not count them again.
+        self._fail_stopped(dropped)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._fail_stopped(self._abandoned)
+        dropped += self._abandoned
+        self._abandoned = []
+
+        if dropped:
+            print(f"Mail queue not drained, {len(dropped)} messages dropped.")
+
+    def _fail_stopped(self, deliveries: List[_Delivery]):
+        for delivery in deliveries:
+            if not delivery.future.done():
+                delivery.future.set_exception(MailDispatcherStopped())
 
-    print(message, fm, email_data, background_tasks)
-    return background_tasks
+    async def enqueue(self, email_data: EmailModel) -> asyncio.Future:
+        """
+        queue a message for delivery, waits while the queue is full.
+
+        Args:
+            email_data (EmailModel): message to send
+
+        Returns:
+            asyncio.Future: resolves once the message is sent, or with the
+            last error once retries are exhausted, or `MailDispatcherStopped`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # callers may fire and forget, so mark failures as retrieved.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self._stopping or not self._workers:
+            future.set_exception(MailDispatcherStopped())
+            return future
+        await self._queue.put(_Delivery(email_data, future))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "retrying": len(self._retries),
+            "open_connections": self.open_connections,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "batches": self.batches,
+            "sent_per_second": self.sent / uptime if uptime else 0.0,
+        }
+
+    def _client(self) -> aiosmtplib.SMTP:
+        credentials = {}
+        if self.config.USE_CREDENTIALS:
+            credentials = {
+                "username": self.config.MAIL_USERNAME,
+                "password": self.config.MAIL_PASSWORD,
+            }
+
+        return aiosmtplib.SMTP(
+            hostname=self.config.MAIL_SERVER,
+            port=self.config.MAIL_PORT,
+            timeout=self.config.TIMEOUT,
+            use_tls=self.config.MAIL_SSL_TLS,
+            start_tls=self.config.MAIL_STARTTLS,
+            validate_certs=self.config.VALIDATE_CERTS,
+            **credentials,
+        )
+
+    def _sender(self) -> str:
+        if self.config.MAIL_FROM_NAME is not None:
+            return f"{self.config.MAIL_FROM_NAME} <{self.config.MAIL_FROM}>"
+        return self.config.MAIL_FROM
+
+    def _render_batch(self, batch: List[_Delivery]) -> List[EmailMessage | Exception]:
+        """
+        render `batch` with one `render_batch` call per template, falling
+        back to one render per message to find the ones that fail.
+
+        Returns:
+            List[EmailMessage | Exception]: message or render error, in the
+            order of `batch`
+        """
+        by_template: Dict[str, List[int]] = {}
+        for index, delivery in enumerate(batch):
+            by_template.setdefault(delivery.email_data.template_name, []).append(index)
+
+        rendered: List[EmailMessage | Exception] = [None] * len(batch)
+        for name, indexes in by_template.items():
+            contexts = [batch[index].email_data.template_body for index in indexes]
+            try:
+                htmls = self.templates.render_batch(name, contexts)
+            except Exception:
+                htmls = []
+                for context in contexts:
+                    try:
+                        htmls.append(self.templates.render(name, context))
+                    except Exception as error:
+                        htmls.append(error)
+            for index, html in zip(indexes, htmls):
+                if not isinstance(html, Exception):
+                    html = self._message(batch[index].email_data, html)
+                rendered[index] = html
+        return rendered
+
+    def _message(self, email_data: EmailModel, html: str) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = email_data.subject
+        message["From"] = self._sender()
+        message["To"] = ", ".join(email_data.email_to)
+        message["Date"] = formatdate(localtime=True)
+        message["Message-ID"] = make_msgid()
+        message.set_content(html, subtype="html")
+        return message
+
+    def _retry_later(self, delivery: _Delivery, error: Exception):
+        if self._stopping:
+            self._fail_stopped([delivery])
+            return
+        if delivery.attempts > self.max_retries:
+            mail_send_failures.inc("true")
+            self.failed += 1
+            if not delivery.future.done():
+                delivery.future.set_exception(error)
+            print(f"Mail to {delivery.email_data.email_to} failed: {error}")
+            return
+
+        mail_send_failures.inc("false")
+        self.retried += 1
+        delay = self.retry_backoff * 2 ** (delivery.attempts - 1)
+
+        def requeue():
+            del self._retries[delivery]
+            try:
+                self._queue.put_nowait(delivery)
+            except asyncio.QueueFull:
+                self._retry_later(delivery, error)
+
+        self._retries[delivery] = asyncio.get_running_loop().call_later(
+            delay, requeue
+        )
+
+    async def _next_batch(self) -> List[_Delivery]:
+        batch = [await self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _worker(self):
+        smtp: aiosmtplib.SMTP | None = None
+        batch: List[_Delivery] = []
+        try:
+            while True:
+                batch = await self._next_batch()
+                self.batches += 1
+                for delivery, message in zip(batch, self._render_batch(batch)):
+                    delivery.attempts += 1
+                    if isinstance(message, Exception):
+                        error = message
+                        self.failed += 1
+                        delivery.future.set_exception(error)
+                        self._queue.task_done()
+                        continue
+
+                    sending_at = time.perf_counter()
+                    try:
+                        if smtp is None or not smtp.is_connected:
+                            if smtp is not None:
+                                smtp.close()
+                                smtp = None
+                                self.open_connections -= 1
+                            client = self._client()
+                            await client.connect()
+                            smtp = client
+                            self.open_connections += 1
+                        if not self.config.SUPPRESS_SEND:
+                            await smtp.send_message(message)
+                        mail_send_duration.observe(time.perf_counter() - sending_at)
+                        self.sent += 1
+                        if not delivery.future.done():
+                            delivery.future.set_result(None)
+                    except Exception as error:
+                        if smtp is not None:
+                            smtp.close()
+                            smtp = None
+                            self.open_connections -= 1
+                        self._retry_later(delivery, error)
+                    finally:
+                        self._queue.task_done()
+        finally:
+            # stopped mid batch, what is left is dropped by `stop`.
+            self._abandoned.extend(d for d in batch if not d.future.done())
+            if smtp is not None:
+                self.open_connections -= 1
+                try:
+                    await smtp.quit()
+                except Exception:
+                    smtp.close()
+
+
+@lru_cache
+def get_mail_dispatcher() -> MailDispatcher:
+    settings = get_settings()
+    dispatcher = MailDispatcher(
+        mail_config(settings),
+        mail_templates,
+        connections=settings.MAIL_CONNECTIONS,
+        batch_size=settings.MAIL_BATCH_SIZE,
+        max_queue=settings.MAIL_QUEUE_SIZE,
+        max_retries=settings.MAIL_MAX_RETRIES,
+        retry_backoff=settings.MAIL_RETRY_BACKOFF_SECONDS,
+    )
+    registry.collector("mail", partial(collect_mail_dispatcher, dispatcher))
+    return dispatcher
@@ -0,0 +1,451 @@
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config.env import get_settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def set_total(self, *labels: str, value: float):
+        # for totals counted elsewhere and copied in by a collector.
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    per label set, a list of per-bucket counts plus sum and count.
+    `observe` is one bisect and three additions, cumulative counts are
+    only computed when rendering.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last, sum]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} "
+                    f"{cumulative}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]!r}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], None]] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, name: str, collect: Callable[[], None]):
+        """
+        run `collect` before every render, to copy numbers a component keeps
+        itself (its `stats()`) into metrics. registering `name` again, e.g.
+        for a recreated singleton, replaces the previous collector.
+        """
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        for collect in list(self._collectors.values()):
+            collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests_in_flight = registry.gauge(
+    "onepass_http_requests_in_flight", "HTTP requests being served."
+)
+http_request_duration = registry.histogram(
+    "onepass_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+admission_in_flight = registry.gauge(
+    "onepass_admission_in_flight",
+    "Requests holding an admission slot, by route class.",
+    ("route_class",),
+)
+admission_queued = registry.gauge(
+    "onepass_admission_queued",
+    "Requests waiting for an admission slot, by route class.",
+    ("route_class",),
+)
+admission_wait = registry.histogram(
+    "onepass_admission_wait_seconds",
+    "Time queued requests waited for an admission slot.",
+    ("route_class",),
+)
+admission_shed = registry.counter(
+    "onepass_admission_shed_total",
+    "Requests rejected with 503 by admission control.",
+    ("route_class", "reason"),
+)
+password_hash_duration = registry.histogram(
+    "onepass_password_hash_duration_seconds",
+    "Time spent hashing or verifying a password, excluding queueing.",
+    ("operation",),
+)
+breached_passwords_rejected = registry.counter(
+    "onepass_breached_passwords_rejected_total",
+    "New passwords rejected because they are in the breach index.",
+)
+password_hash_wait = registry.histogram(
+    "onepass_password_hash_wait_seconds",
+    "Time spent waiting for a password hashing slot.",
+)
+db_query_duration = registry.histogram(
+    "onepass_db_query_duration_seconds",
+    "Database statement latency by statement type.",
+    ("statement",),
+)
+db_replica_healthy = registry.gauge(
+    "onepass_db_replica_healthy",
+    "1 while a read replica is answering and within the allowed lag.",
+    ("replica",),
+)
+db_replica_lag = registry.gauge(
+    "onepass_db_replica_lag_seconds",
+    "Replay lag of a read replica at its last health check.",
+    ("replica",),
+)
+db_replica_fallbacks = registry.counter(
+    "onepass_db_replica_fallbacks_total",
+    "Replica reads answered by the primary instead.",
+    ("reason",),
+)
+jwt_duration = registry.histogram(
+    "onepass_jwt_duration_seconds",
+    "JWT encode and decode time.",
+    ("operation",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+audit_queued = registry.gauge(
+    "onepass_audit_queued",
+    "Audit events waiting to be written.",
+)
+audit_flushed = registry.counter(
+    "onepass_audit_flushed_total",
+    "Audit events written to the database.",
+)
+audit_dropped = registry.counter(
+    "onepass_audit_dropped_total",
+    "Audit events dropped because the queue stayed full.",
+)
+audit_flush_duration = registry.histogram(
+    "onepass_audit_flush_duration_seconds",
+    "Time to write one batch of audit events.",
+)
+password_hash_queue_depth = registry.gauge(
+    "onepass_password_hash_queue_depth",
+    "Password hashing calls waiting for a worker.",
+)
+password_hash_in_flight = registry.gauge(
+    "onepass_password_hash_in_flight",
+    "Password hashing calls running on a worker.",
+)
+password_hash_operations = registry.counter(
+    "onepass_password_hash_operations_total",
+    "Password hashing calls by outcome.",
+    ("outcome",),
+)
+cache_entries = registry.gauge(
+    "onepass_cache_entries",
+    "Entries held by an in-process cache.",
+    ("cache",),
+)
+cache_events = registry.counter(
+    "onepass_cache_events_total",
+    "In-process cache lookups and removals by kind.",
+    ("cache", "event"),
+)
+rate_limit_rejected = registry.counter(
+    "onepass_rate_limit_rejected_total",
+    "Requests rejected with 429 by the rate limiter.",
+)
+rate_limit_buckets = registry.gauge(
+    "onepass_rate_limit_buckets",
+    "Rate limit buckets held in memory.",
+)
+mail_queue_depth = registry.gauge(
+    "onepass_mail_queue_depth",
+    "Messages waiting for an SMTP worker.",
+)
+mail_retrying = registry.gauge(
+    "onepass_mail_retrying",
+    "Messages waiting out a retry backoff.",
+)
+mail_open_connections = registry.gauge(
+    "onepass_mail_open_connections",
+    "SMTP connections held open by the mail workers.",
+)
+mail_messages = registry.counter(
+    "onepass_mail_messages_total",
+    "Mail delivery attempts by outcome.",
+    ("outcome",),
+)
+mail_batches = registry.counter(
+    "onepass_mail_batches_total",
+    "Batches taken from the mail queue.",
+)
+outbox_messages = registry.counter(
+    "onepass_outbox_messages_total",
+    "Outbox rows handled by the outbox dispatcher, by outcome.",
+    ("outcome",),
+)
+mail_send_duration = registry.histogram(
+    "onepass_mail_send_duration_seconds",
+    "SMTP delivery latency per message, including reconnects.",
+)
+mail_send_failures = registry.counter(
+    "onepass_mail_send_failures_total",
+    "Failed SMTP delivery attempts.",
+    ("final",),
+)
+
+
+def collect_cache(name: str, cache: Any):
+    stats = cache.stats()
+    cache_entries.set(name, value=stats["size"])
+    for event in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        cache_events.set_total(name, event, value=stats[event])
+
+
+def collect_password_hasher(hasher: Any):
+    stats = hasher.stats()
+    password_hash_queue_depth.set(value=stats["queue_depth"])
+    password_hash_in_flight.set(value=stats["in_flight"])
+    for outcome in ("completed", "rejected", "timed_out"):
+        password_hash_operations.set_total(outcome, value=stats[outcome])
+
+
+def collect_rate_limiter(limiter: Any):
+    stats = limiter.stats()
+    rate_limit_rejected.set_total(value=stats["rejected"])
+    if stats["buckets"] >= 0:
+        rate_limit_buckets.set(value=stats["buckets"])
+
+
+def collect_mail_dispatcher(dispatcher: Any):
+    stats = dispatcher.stats()
+    mail_queue_depth.set(value=stats["queue_depth"])
+    mail_retrying.set(value=stats["retrying"])
+    mail_open_connections.set(value=stats["open_connections"])
+    mail_batches.set_total(value=stats["batches"])
+    for outcome in ("sent", "failed", "retried"):
+        mail_messages.set_total(outcome, value=stats[outcome])
+
+
+def collect_outbox_dispatcher(dispatcher: Any):
+    stats = dispatcher.stats()
+    for outcome in ("claimed", "sent", "retried", "failed"):
+        outbox_messages.set_total(outcome, value=stats[outcome])
+
+
+class MetricsMiddleware:
+    """
+    pure ASGI middleware timing every http request.
+
+    requests are labelled by route template (`/auth/verify/{token}`) rather
+    than path, so label cardinality stays bounded by the number of routes.
+    does nothing when METRICS_ENABLED is false.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+        self.enabled: bool | None = None
+
+    async def __call__(self, scope, receive, send):
+        if self.enabled is None:
+            self.enabled = get_settings().METRICS_ENABLED
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else "other",
+                str(status_code),
+            )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        keyword = statement.lstrip()[:6].upper()
+        if keyword not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            keyword = "OTHER"
+        db_query_duration.observe(time.perf_counter() - started, keyword)
+
+
+def instrument_engine(engine: Engine):
+    """
+    time every statement run by `engine`, pass `AsyncEngine.sync_engine`
+    for async engines.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
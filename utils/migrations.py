@@ -0,0 +1,150 @@
+import asyncio
+from typing import List, Tuple
+from sqlalchemy import MetaData, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from utils.locks import MIGRATION_LOCK_ID
+
+# `SQLModel.metadata.create_all` only creates missing tables, so changes to
+# existing tables are applied here. Each migration is a name and one or more
+# statements, applied once and recorded in schema_migrations. Statements must
+# still be idempotent: a migration that fails part way is retried whole.
+MIGRATIONS: List[Tuple[str, str | Tuple[str, ...]]] = [
+    (
+        "normalize_users_email",
+        "UPDATE users SET email = lower(btrim(email)) "
+        "WHERE email <> lower(btrim(email))",
+    ),
+    (
+        "create_ix_users_email_lower",
+        (
+            # left behind by an interrupted concurrent build.
+            "DO $$ BEGIN "
+            "IF EXISTS (SELECT 1 FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = 'ix_users_email_lower' AND NOT i.indisvalid) THEN "
+            "DROP INDEX ix_users_email_lower; "
+            "END IF; END $$",
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email_lower "
+            "ON users (lower(email))",
+        ),
+    ),
+    (
+        "add_users_vault_revision",
+        "DO $$ BEGIN "
+        "IF NOT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'users' AND column_name = 'vault_revision') THEN "
+        "ALTER TABLE users ADD COLUMN vault_revision BIGINT NOT NULL DEFAULT 0; "
+        "END IF; END $$",
+    ),
+    (
+        "create_audit_events_append_only",
+        "CREATE OR REPLACE FUNCTION audit_events_append_only() RETURNS trigger "
+        "LANGUAGE plpgsql AS $$ BEGIN "
+        "RAISE EXCEPTION 'audit_events is append-only'; "
+        "END $$",
+    ),
+    (
+        "create_tr_audit_events_append_only",
+        "DO $$ BEGIN "
+        "IF NOT EXISTS (SELECT 1 FROM pg_trigger "
+        "WHERE tgname = 'tr_audit_events_append_only' "
+        "AND tgrelid = 'audit_events'::regclass) THEN "
+        "CREATE TRIGGER tr_audit_events_append_only "
+        "BEFORE UPDATE OR DELETE ON audit_events FOR EACH ROW "
+        "EXECUTE FUNCTION audit_events_append_only(); "
+        "END IF; END $$",
+    ),
+]
+
+
+# checked before the migration of the same name, which would otherwise fail
+# on the rows they return. each row is (value, count).
+DUPLICATE_EMAILS = (
+    "SELECT lower(btrim(email)), count(*) FROM users "
+    "GROUP BY 1 HAVING count(*) > 1 ORDER BY 1 LIMIT 20"
+)
+CHECKS = {
+    "normalize_users_email": DUPLICATE_EMAILS,
+    "create_ix_users_email_lower": DUPLICATE_EMAILS,
+}
+
+LOCK_POLL_SECONDS = 0.5
+
+
+class MigrationError(Exception):
+    pass
+
+
+async def _check(conn: AsyncConnection, name: str):
+    query = CHECKS.get(name)
+    if query is None:
+        return
+    rows = (await conn.execute(text(query))).all()
+    if rows:
+        found = ", ".join(f"{value} ({count})" for value, count in rows)
+        raise MigrationError(
+            f"Cannot apply migration {name}: emails that only differ by case "
+            f"or whitespace belong to more than one user: {found}. Merge or "
+            "rename these accounts, then restart."
+        )
+
+
+async def run_migrations(engine: AsyncEngine, metadata: MetaData):
+    """
+    create missing tables, then apply the MIGRATIONS not yet recorded in
+    schema_migrations, in order.
+
+    runs in autocommit mode so indexes can be built CONCURRENTLY without
+    blocking writes on a live table, under a session advisory lock so nodes
+    starting together, even on an empty database, do this one at a time.
+
+    Args:
+        engine (AsyncEngine): database engine
+        metadata (MetaData): tables to create
+
+    Raises:
+        MigrationError: existing data would make a migration fail.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # an index build may outlast the default.
+        await conn.execute(text("SET statement_timeout = 0"))
+        # poll rather than block in pg_advisory_lock: a CONCURRENTLY build on
+        # the node holding the lock waits for every open transaction, the
+        # blocked call included, which deadlocks.
+        while not await conn.scalar(
+            text(f"SELECT pg_try_advisory_lock({MIGRATION_LOCK_ID})")
+        ):
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            await conn.run_sync(metadata.create_all)
+            await conn.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "name TEXT PRIMARY KEY, "
+                    "applied_at TIMESTAMP NOT NULL DEFAULT now())"
+                )
+            )
+            applied = set(
+                (await conn.execute(text("SELECT name FROM schema_migrations")))
+                .scalars()
+                .all()
+            )
+            for name, statements in MIGRATIONS:
+                if name in applied:
+                    continue
+                await _check(conn, name)
+                print(f"Applying migration {name}.")
+                if isinstance(statements, str):
+                    statements = (statements,)
+                for statement in statements:
+                    await conn.execute(text(statement))
+                await conn.execute(
+                    text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+                    {"name": name},
+                )
+        finally:
+            await conn.execute(
+                text(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_ID})")
+            )
+            await conn.execute(text("RESET statement_timeout"))
@@ -0,0 +1,230 @@
+import asyncio
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from typing import Any, Dict, List
+from sqlalchemy import and_, delete, or_, select, update
+from config.env import get_settings
+from schemas import EmailOutbox, OutboxStatus
+from utils.db import async_session
+from utils.mail import get_mail_dispatcher
+from utils.metrics import collect_outbox_dispatcher, registry
+
+
+class OutboxDispatcher:
+    """
+    sends the rows of the email_outbox table.
+
+    rows are claimed in batches with `FOR UPDATE SKIP LOCKED`, so any
+    number of nodes can run a dispatcher without sending a row twice.
+    a claimed row that is not resolved within `lease_seconds` (node died
+    mid batch) becomes claimable again. the lease is renewed while a batch
+    is in flight, so a batch slowed down by mail retries keeps its rows.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        poll_interval: float,
+        lease_seconds: float,
+        max_attempts: int,
+        retry_backoff: float,
+    ):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+        self.claimed = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="outbox-dispatcher")
+
+    async def stop(self, timeout: float = 15.0):
+        """
+        stop claiming rows and give the batch in flight up to `timeout`
+        seconds to record its results, then cancel it. stop the mail
+        dispatcher meanwhile, so unsent rows go back to pending right away.
+        """
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def notify(self):
+        """
+        wake the dispatcher after committing new outbox rows.
+        """
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "claimed": self.claimed,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    async def _claim(self, db) -> List[EmailOutbox]:
+        now = datetime.now()
+        claimable = (
+            select(EmailOutbox.id)
+            .where(
+                or_(
+                    and_(
+                        EmailOutbox.status == OutboxStatus.PENDING,
+                        EmailOutbox.available_at <= now,
+                    ),
+                    and_(
+                        EmailOutbox.status == OutboxStatus.PROCESSING,
+                        EmailOutbox.claimed_at
+                        < now - timedelta(seconds=self.lease_seconds),
+                    ),
+                )
+            )
+            .order_by(EmailOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(claimable.scalar_subquery()))
+            .values(
+                status=OutboxStatus.PROCESSING,
+                claimed_at=now,
+                attempts=EmailOutbox.attempts + 1,
+            )
+            .returning(EmailOutbox)
+            .execution_options(synchronize_session=False)
+        )
+        rows = (await db.execute(statement)).scalars().all()
+        await db.commit()
+        return list(rows)
+
+    async def _renew_lease(self, ids: List[int], claimed_at: datetime):
+        """
+        move `claimed_at` of rows `ids` forward every third of the lease
+        until cancelled. rows whose claim changed are no longer ours.
+        """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            renewed_at = datetime.now()
+            try:
+                async with async_session() as db:
+                    await db.execute(
+                        update(EmailOutbox)
+                        .where(
+                            EmailOutbox.id.in_(ids),
+                            EmailOutbox.claimed_at == claimed_at,
+                        )
+                        .values(claimed_at=renewed_at)
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as error:
+                print(f"Outbox lease renewal failed: {error}")
+                continue
+            claimed_at = renewed_at
+
+    async def _dispatch_batch(self) -> int:
+        async with async_session() as db:
+            rows = await self._claim(db)
+            if not rows:
+                return 0
+            self.claimed += len(rows)
+
+            renewal = asyncio.create_task(
+                self._renew_lease([row.id for row in rows], rows[0].claimed_at)
+            )
+            try:
+                mail_dispatcher = get_mail_dispatcher()
+                futures = [
+                    await mail_dispatcher.enqueue(row.to_email()) for row in rows
+                ]
+                results = await asyncio.gather(*futures, return_exceptions=True)
+            finally:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+
+            sent_ids = []
+            now = datetime.now()
+            for row, result in zip(rows, results):
+                if not isinstance(result, Exception):
+                    sent_ids.append(row.id)
+                    continue
+
+                values = {"last_error": str(result)[:500], "claimed_at": None}
+                if row.attempts >= self.max_attempts:
+                    self.failed += 1
+                    values["status"] = OutboxStatus.FAILED
+                else:
+                    self.retried += 1
+                    values["status"] = OutboxStatus.PENDING
+                    values["available_at"] = now + timedelta(
+                        seconds=self.retry_backoff * 2 ** (row.attempts - 1)
+                    )
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == row.id)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+
+            if sent_ids:
+                self.sent += len(sent_ids)
+                await db.execute(
+                    delete(EmailOutbox)
+                    .where(EmailOutbox.id.in_(sent_ids))
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+            return len(rows)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await self._dispatch_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                print(f"Outbox dispatch failed: {error}")
+                claimed = 0
+
+            if claimed < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+
+@lru_cache
+def get_outbox_dispatcher() -> OutboxDispatcher:
+    settings = get_settings()
+    dispatcher = OutboxDispatcher(
+        batch_size=settings.OUTBOX_BATCH_SIZE,
+        poll_interval=settings.OUTBOX_POLL_INTERVAL_SECONDS,
+        lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+        max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+        retry_backoff=settings.OUTBOX_RETRY_BACKOFF_SECONDS,
+    )
+    registry.collector("outbox", partial(collect_outbox_dispatcher, dispatcher))
+    return dispatcher
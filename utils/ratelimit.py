@@ -0,0 +1,203 @@
+import ipaddress
+import time
+from functools import lru_cache, partial
+from typing import Callable, Dict, Protocol, Tuple
+from fastapi import HTTPException, Request, status
+from config.env import Settings, get_settings
+from utils.metrics import collect_rate_limiter, registry
+
+
+class RateLimitBackend(Protocol):
+    """
+    storage for token buckets. the in-memory backend below is per process;
+    a shared store (redis, memcached, ...) can implement the same method to
+    enforce limits across nodes.
+    """
+
+    async def take(
+        self, key: str, rate: float, capacity: float, cost: float = 1.0
+    ) -> Tuple[bool, float]:
+        """
+        take `cost` tokens from the bucket `key`.
+
+        Returns:
+            Tuple[bool, float]: whether the request is allowed, and if not,
+            seconds until enough tokens are available.
+        """
+        ...
+
+
+class MemoryBackend:
+    """
+    token buckets kept as `key -> (tokens, updated_at, full_at)` tuples.
+
+    a bucket past its `full_at` has refilled completely and holds no
+    information, so `sweep` drops it; memory only grows with the number
+    of recently active keys.
+    """
+
+    def __init__(self, sweep_interval: float = 60.0):
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(
+        self, key: str, rate: float, capacity: float, cost: float = 1.0
+    ) -> Tuple[bool, float]:
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate
+
+    def sweep(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        expired = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in expired:
+            del self._buckets[key]
+
+
+class RateLimit:
+    """
+    `requests` per `seconds`, with bursts of up to `requests`.
+    """
+
+    def __init__(self, requests: int, seconds: float):
+        self.capacity = float(requests)
+        self.rate = requests / seconds
+
+
+# names of the configured limits, see `rate_limits`.
+LOGIN_IP_LIMIT = "login_ip"
+LOGIN_EMAIL_LIMIT = "login_email"
+REGISTER_IP_LIMIT = "register_ip"
+MAIL_IP_LIMIT = "mail_ip"
+MAIL_EMAIL_LIMIT = "mail_email"
+
+
+def rate_limits(settings: Settings) -> Dict[str, RateLimit]:
+    return {
+        LOGIN_IP_LIMIT: RateLimit(settings.RATE_LIMIT_LOGIN_PER_IP, 60),
+        LOGIN_EMAIL_LIMIT: RateLimit(settings.RATE_LIMIT_LOGIN_PER_EMAIL, 60),
+        REGISTER_IP_LIMIT: RateLimit(settings.RATE_LIMIT_REGISTER_PER_IP, 3600),
+        MAIL_IP_LIMIT: RateLimit(settings.RATE_LIMIT_MAIL_PER_IP, 3600),
+        MAIL_EMAIL_LIMIT: RateLimit(settings.RATE_LIMIT_MAIL_PER_EMAIL, 3600),
+    }
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        limits: Dict[str, RateLimit],
+        enabled: bool = True,
+    ):
+        self.backend = backend
+        self.limits = limits
+        self.enabled = enabled
+        self.rejected = 0
+
+    async def hit(self, key: str, limit: str):
+        """
+        count one request against `key` under the limit named `limit`.
+
+        Raises:
+            HTTPException: 429 with Retry-After once the bucket is empty.
+        """
+        if not self.enabled:
+            return
+
+        rate_limit = self.limits[limit]
+        allowed, retry_after = await self.backend.take(
+            key, rate=rate_limit.rate, capacity=rate_limit.capacity
+        )
+        if not allowed:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later.",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+            )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rejected": self.rejected,
+            "buckets": len(self.backend) if hasattr(self.backend, "__len__") else -1,
+        }
+
+
+@lru_cache
+def get_rate_limiter() -> RateLimiter:
+    settings = get_settings()
+    limiter = RateLimiter(
+        MemoryBackend(), rate_limits(settings), enabled=settings.RATE_LIMIT_ENABLED
+    )
+    registry.collector("rate_limiter", partial(collect_rate_limiter, limiter))
+    return limiter
+
+
+def client_ip(request: Request) -> str | None:
+    """
+    address of the client behind the trusted proxies.
+
+    a request from a TRUSTED_PROXIES address takes the right-most
+    X-Forwarded-For entry that is not itself a trusted proxy; entries left
+    of it are set by the client and can be forged. an entry that is not an
+    ip ends the chain at the proxy that added it.
+
+    Returns:
+        str | None: client ip, None when the server does not know the peer
+    """
+    peer = request.client.host if request.client else None
+    proxies = get_settings().TRUSTED_PROXIES
+    if peer is None or not proxies:
+        return peer
+
+    hops = [
+        hop.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for hop in header.split(",")
+    ]
+    client = peer
+    for hop in [peer, *reversed(hops)]:
+        try:
+            address = ipaddress.ip_address(hop)
+        except ValueError:
+            break
+        client = str(address)
+        if not any(address in network for network in proxies):
+            break
+    return client
+
+
+def per_ip(scope: str, limit: str) -> Callable:
+    """
+    dependency limiting a route per client ip, see `client_ip`.
+    """
+
+    async def dependency(request: Request):
+        client = client_ip(request) or "unknown"
+        await get_rate_limiter().hit(f"{scope}:ip:{client}", limit)
+
+    return dependency
+
+
+async def per_email(scope: str, email: str, limit: str):
+    await get_rate_limiter().hit(f"{scope}:email:{email}", limit)
@@ -0,0 +1,59 @@
+from hashlib import blake2b
+from typing import Any, Dict, Mapping
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered by pydantic-core straight to bytes.
+
+    pydantic models, dicts, lists and datetimes are serialized without going
+    through `jsonable_encoder` and `json.dumps`. routes return it themselves,
+    so FastAPI also skips re-validating the body against `response_model`;
+    only build it from models that are already valid.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def message(
+    text: str, status_code: int = 200, headers: Mapping[str, str] | None = None
+) -> FastJSONResponse:
+    """
+    the `{"message": ...}` body used by most auth endpoints.
+    """
+    return FastJSONResponse({"message": text}, status_code=status_code, headers=headers)
+
+
+def make_etag(*version: Any) -> str:
+    """
+    strong ETag for a response fully determined by `version`, e.g. the
+    user id and `updated_at`, so it can be checked before building the body.
+    """
+    stamp = "\x1f".join(str(part) for part in version).encode()
+    return f'"{blake2b(stamp, digest_size=12).hexdigest()}"'
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # private: per user data, no-cache: clients revalidate with the ETag.
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """
+    whether the client already has the `etag` version (weak comparison).
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip().removeprefix("W/") for tag in header.split(","))
+    return etag.removeprefix("W/") in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
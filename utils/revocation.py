@@ -0,0 +1,161 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+from sqlalchemy import delete
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from config.env import get_settings
+from schemas import TokenRevocation
+from utils.db import async_session
+
+
+class RevocationStore:
+    """
+    in-process denylist fronting the token_revocations table.
+
+    `is_revoked` is two dict lookups, with no query per request. entries
+    are dropped once the tokens they cover have expired. revocations made
+    on other nodes are picked up by `sync` every `sync_interval` seconds.
+    """
+
+    def __init__(self, sync_interval: float):
+        self.sync_interval = sync_interval
+
+        self._jtis: Dict[str, float] = {}
+        self._subjects: Dict[str, Tuple[float, float]] = {}
+        self._synced_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._jtis) + len(self._subjects)
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        jti = claims.get("jti")
+        if jti is not None and jti in self._jtis:
+            return True
+
+        if self._subjects:
+            cutoff = self._subjects.get(claims.get("email"))
+            if cutoff is not None and claims.get("iat", 0) <= cutoff[0]:
+                return True
+        return False
+
+    def _remember(self, row: TokenRevocation):
+        expires_at = row.expires_at.timestamp()
+        if row.jti is not None:
+            self._jtis[row.jti] = expires_at
+        elif row.subject is not None:
+            current = self._subjects.get(row.subject)
+            if current is None or current[0] < row.issued_before:
+                self._subjects[row.subject] = (row.issued_before, expires_at)
+
+    def revoke_token(self, db: AsyncSession, claims: Dict[str, Any]):
+        """
+        revoke one token, persisted with the caller's commit.
+
+        Args:
+            db (AsyncSession): session the caller commits
+            claims (Dict[str, Any]): decoded claims of the token
+
+        Raises:
+            ValueError: for a token without `jti`, see `revoke_subject`.
+        """
+        if "jti" not in claims:
+            raise ValueError("token has no jti, revoke its subject instead")
+
+        row = TokenRevocation(
+            jti=claims["jti"],
+            expires_at=datetime.fromtimestamp(claims["exp"]),
+            created_at=datetime.now(),
+        )
+        db.add(row)
+        self._remember(row)
+
+    def revoke_subject(
+        self,
+        db: AsyncSession,
+        email: str,
+        lifetime_minutes: int,
+        issued_before: float | None = None,
+    ):
+        """
+        revoke every token issued to `email` up to `issued_before`, or so
+        far, persisted with the caller's commit.
+
+        Args:
+            db (AsyncSession): session the caller commits
+            email (str): token subject
+            lifetime_minutes (int): longest lifetime of the affected tokens
+            issued_before (float | None): latest `iat` revoked, default now
+        """
+        curr_date = datetime.now()
+        row = TokenRevocation(
+            subject=email,
+            issued_before=time.time() if issued_before is None else issued_before,
+            expires_at=curr_date + timedelta(minutes=lifetime_minutes),
+            created_at=curr_date,
+        )
+        db.add(row)
+        self._remember(row)
+
+    def prune(self):
+        now = time.time()
+        self._jtis = {jti: exp for jti, exp in self._jtis.items() if exp > now}
+        self._subjects = {
+            subject: cutoff
+            for subject, cutoff in self._subjects.items()
+            if cutoff[1] > now
+        }
+
+    async def sync(self):
+        """
+        load revocations written since the last sync, including other
+        nodes', then drop expired entries here and in the table.
+        """
+        curr_date = datetime.now()
+        statement = select(TokenRevocation).where(
+            TokenRevocation.expires_at > curr_date
+        )
+        if self._synced_at is not None:
+            # overlap so rows from transactions that committed late are seen.
+            since = self._synced_at - timedelta(seconds=self.sync_interval * 2)
+            statement = statement.where(TokenRevocation.created_at >= since)
+
+        async with async_session() as db:
+            for row in (await db.exec(statement=statement)).all():
+                self._remember(row)
+            await db.exec(
+                statement=delete(TokenRevocation).where(
+                    TokenRevocation.expires_at <= curr_date
+                )
+            )
+            await db.commit()
+
+        self._synced_at = curr_date
+        self.prune()
+
+    async def start(self):
+        await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="revocation-sync")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as error:
+                print(f"Revocation sync failed: {error}")
+
+
+@lru_cache
+def get_revocations() -> RevocationStore:
+    return RevocationStore(sync_interval=get_settings().REVOCATION_SYNC_SECONDS)
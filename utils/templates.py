@@ -0,0 +1,72 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+
+TEMPLATE_FOLDER = Path(__file__).parent.parent / "templates"
+
+
+class MailTemplates:
+    """
+    one jinja environment for mail and the /emails previews.
+
+    templates are compiled once by `load` and static globals are computed
+    there too, so rendering a message only fills in per-recipient fields
+    such as `name` and `link`. the globals are recomputed when the year
+    they were computed for ends.
+    """
+
+    def __init__(self, directory: Path, names: Iterable[str]):
+        self.names = list(names)
+        self.env = Environment(
+            loader=FileSystemLoader(directory),
+            autoescape=select_autoescape(["html", "xml"]),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        self._compiled: Dict[str, Template] = {}
+        self._globals_expire_at = 0.0
+
+    def refresh_globals(self):
+        if time.time() < self._globals_expire_at:
+            return
+        now = datetime.now()
+        self.env.globals["copyright_text"] = (
+            f"Copyright © {now.year}. FluxTech, All rights reserved."
+        )
+        self._globals_expire_at = datetime(now.year + 1, 1, 1).timestamp()
+
+    def load(self):
+        self.refresh_globals()
+        self._compiled = {name: self.env.get_template(name) for name in self.names}
+
+    def get(self, name: str) -> Template:
+        template = self._compiled.get(name)
+        if template is None:
+            template = self._compiled[name] = self.env.get_template(name)
+        return template
+
+    def render(self, name: str, context: Dict[str, Any]) -> str:
+        self.refresh_globals()
+        return self.get(name).render(context)
+
+    def render_batch(self, name: str, contexts: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        render one template for many recipients.
+
+        Args:
+            name (str): template name
+            contexts (Iterable[Dict[str, Any]]): per-recipient fields
+
+        Returns:
+            List[str]: rendered html, in the order of `contexts`
+        """
+        self.refresh_globals()
+        template = self.get(name)
+        return [template.render(context) for context in contexts]
+
+
+mail_templates = MailTemplates(
+    TEMPLATE_FOLDER, names=["register.html", "password_reset.html"]
+)